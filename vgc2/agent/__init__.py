@@ -25,6 +25,14 @@ class BattlePolicy(ABC):
                  opp_view: Optional[TeamView] = None) -> list[BattleCommand]:
         pass
 
+    def decision_batch(self,
+                       states: list[State]) -> list[list[BattleCommand]]:
+        """
+        Decisions for many states at once, such as the pending battles of a vectorized environment. Policies that can
+        batch their inference should override it, by default each state is decided in turn.
+        """
+        return [self.decision(state) for state in states]
+
 
 class SelectionPolicy(ABC):
 
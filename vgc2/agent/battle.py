@@ -1,15 +1,23 @@
+import multiprocessing as mp
+import pickle
+import random
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from itertools import product
-from math import prod
+from math import prod, log, sqrt, ceil
 from random import sample
+from time import time
 from typing import Optional
 
-from numpy import argmax
-from numpy.random import choice
+from numpy import argmax, ndarray, zeros, array, where, maximum, arange, unravel_index
+from numpy.random import choice, Generator, seed
 
 from vgc2.agent import BattlePolicy
 from vgc2.battle_engine import State, BattleCommand, calculate_damage, BattleRuleParam, BattlingTeam, BattlingPokemon, \
-    BattlingMove, TeamView
-from vgc2.util.forward import copy_state, forward
+    BattlingMove, Move, TeamView, BattleEngine, Journal, _RNG
+from vgc2.battle_engine import zobrist
+from vgc2.battle_engine.pokemon import Pokemon
+from vgc2.util.forward import copy_state, copy_battling_pokemon, forward
 from vgc2.util.rng import ZERO_RNG, ONE_RNG
 
 
@@ -53,27 +61,48 @@ def greedy_single_battle_decision(params: BattleRuleParam,
     return [(int(argmax(outcomes)), 0) if outcomes else (0, 0)]
 
 
+def damage_matrix(params: BattleRuleParam,
+                  state: State,
+                  attackers: list[BattlingPokemon],
+                  defenders: list[BattlingPokemon]) -> tuple[ndarray, ndarray]:
+    """
+    Damage of each attacker move on each defender, of shape attackers × moves × defenders, and which moves can be
+    used, of shape attackers × moves. Padded or unusable moves deal no damage.
+    """
+    n_moves = max((len(a.battling_moves) for a in attackers), default=0)
+    damage = zeros((len(attackers), n_moves, len(defenders)))
+    usable = zeros((len(attackers), n_moves), dtype=bool)
+    for i, attacker in enumerate(attackers):
+        for j, move in enumerate(attacker.battling_moves):
+            if move.pp == 0 or move.disabled:
+                continue
+            usable[i, j] = True
+            for k, defender in enumerate(defenders):
+                damage[i, j, k] = calculate_damage(params, 0, move.constants, state, attacker, defender)
+    return damage, usable
+
+
 def greedy_double_battle_decision(params: BattleRuleParam,
                                   state: State) -> list[BattleCommand]:
     attackers, defenders = state.sides[0].team.active, state.sides[1].team.active
-    strategies = []
-    for sources in product(list(range(len(attackers[0].battling_moves))),
-                           list(range(len(attackers[1].battling_moves))) if len(attackers) > 1 else []):
-        for targets in product(list(range(len(defenders))), list(range(len(defenders)))):
-            damage, ko, hp = 0, 0, [d.hp for d in defenders]
-            for i, (source, target) in enumerate(zip(sources, targets)):
-                attacker, defender, move = attackers[i], defenders[target], attackers[i].battling_moves[source]
-                if move.pp == 0 or move.disabled:
-                    continue
-                new_hp = max(0, hp[target] - calculate_damage(params, 0, move.constants, state, attacker, defender))
-                damage += hp[target] - new_hp
-                ko += int(new_hp == 0)
-                hp[target] = new_hp
-            strategies += [(ko, damage, sources, targets)]
-    if len(strategies) == 0:
+    n_moves = [len(a.battling_moves) for a in attackers]
+    if len(attackers) < 2 or len(defenders) == 0 or 0 in n_moves:
         return [(choice(len(a.battling_moves)), choice(len(defenders))) for a in attackers]
-    best = max(strategies, key=lambda x: 1000 * x[0] + x[1])
-    return list(zip(best[2], best[3]))
+    damage, usable = damage_matrix(params, state, attackers, defenders)
+    # strategies are scored over axes (move 0, move 1, target 0, target 1), the first attacker hits first
+    hp = array([d.hp for d in defenders], dtype=float)
+    u0 = usable[0, :n_moves[0], None, None, None]
+    hp0 = hp[None, None, :, None]
+    new_hp0 = where(u0, maximum(0., hp0 - damage[0, :n_moves[0], None, :, None]), hp0)
+    ko = u0 & (new_hp0 == 0.)
+    same_target = (arange(len(defenders))[:, None] == arange(len(defenders))[None, :])[None, None]
+    hp1 = where(same_target, new_hp0, hp[None, None, None, :])
+    u1 = usable[1, None, :n_moves[1], None, None]
+    new_hp1 = where(u1, maximum(0., hp1 - damage[1, None, :n_moves[1], None, :]), hp1)
+    ko = ko.astype(int) + (u1 & (new_hp1 == 0.))
+    score = 1000 * ko + (hp0 - new_hp0) + (hp1 - new_hp1)
+    m0, m1, t0, t1 = unravel_index(int(argmax(score)), score.shape)
+    return [(int(m0), int(t0)), (int(m1), int(t1))]
 
 
 class GreedyBattlePolicy(BattlePolicy):
@@ -98,7 +127,10 @@ class GreedyBattlePolicy(BattlePolicy):
 
 # TreeSearchBattlePolicy
 
-def get_actions(team: tuple[BattlingTeam, BattlingTeam]) -> list[list[BattleCommand]]:
+def get_commands(team: tuple[BattlingTeam, BattlingTeam]) -> list[list[BattleCommand]]:
+    """
+    Commands available to each active Pokémon of the first team.
+    """
     attackers = team[0].active
     move_targets = [i for i in range(len(team[1].active))]
     switch_targets = [i for i, p in enumerate(team[0].reserve) if p.hp > 0]
@@ -106,15 +138,24 @@ def get_actions(team: tuple[BattlingTeam, BattlingTeam]) -> list[list[BattleComm
     for attacker in attackers:
         moves = [i for i, m in enumerate(attacker.battling_moves) if m.pp > 0 and not m.disabled]
         commands += [list(product(moves, move_targets)) + list(product([-1], switch_targets))]
-    return list(product(*commands))
+    return commands
+
+
+def get_actions(team: tuple[BattlingTeam, BattlingTeam]) -> list[list[BattleCommand]]:
+    return list(product(*get_commands(team)))
+
+
+def _hidden_moves(pokemon: BattlingPokemon) -> list[Move]:
+    ids = [m.constants.id for m in pokemon.battling_moves]
+    return [m for m in pokemon.constants.species.moves if m.id not in ids]
 
 
 def _deduce_moves(pokemon: BattlingPokemon,
-                  max_moves: int):
+                  max_moves: int,
+                  moves: list[Move] | None = None):
     n_moves = len(pokemon.battling_moves)
     if n_moves < max_moves:
-        ids = [m.constants.id for m in pokemon.battling_moves]
-        moves = [m for m in pokemon.constants.species.moves if m.id not in ids]
+        moves = _hidden_moves(pokemon) if moves is None else moves
         pokemon.battling_moves += [BattlingMove(m) for m in sample(moves, max_moves - n_moves)]  # ignoring meta
 
 
@@ -136,6 +177,37 @@ def deduce_state(state: State,
     return _state
 
 
+def deduce_states(state: State,
+                  opp_team_view: TeamView,
+                  max_moves: int,
+                  n: int) -> list[State]:
+    """
+    n independent samples of deduce_state. The revealed part of the opponent team, and the members and moves that may
+    complete it, are worked out once from the view, each sample then only draws the hidden part.
+    """
+    base = copy_state(state)
+    opp_team = base.sides[1].team
+    known = opp_team.active + opp_team.reserve
+    ids = [p.constants.species.id for p in known]
+    candidates = [BattlingPokemon(p) for p in opp_team_view.members if p.species.id not in ids]
+    n_hidden = len(opp_team_view.members) - len(known)
+    known_moves = [_hidden_moves(p) for p in known]
+    candidate_moves = {id(p): _hidden_moves(p) for p in candidates}
+    states = []
+    for _ in range(n):
+        _state = copy_state(base)
+        opp_team = _state.sides[1].team
+        for p, moves in zip(opp_team.active + opp_team.reserve, known_moves):
+            _deduce_moves(p, max_moves, moves)
+        if n_hidden > 0:
+            for p in sample(candidates, n_hidden):
+                _p = copy_battling_pokemon(p)
+                _deduce_moves(_p, max_moves, candidate_moves[id(p)])
+                opp_team.reserve += [_p]
+        states += [_state]
+    return states
+
+
 def eval_state(state: State) -> float:
     my_team = state.sides[0].team
     my_hp = sum(p.hp / p.constants.stats[0] for p in my_team.active + my_team.reserve)
@@ -144,28 +216,219 @@ def eval_state(state: State) -> float:
     return my_hp - 3 * opp_hp + 3. * (len(opp_team.active) + len(opp_team.reserve))
 
 
+def state_key(state: State) -> bytes:
+    """
+    Key of the dynamic state, equal for equal positions of the same State objects.
+    """
+    return state.to_buffer().tobytes()
+
+
+class TranspositionTable:
+    """
+    Bounded map from searched positions to their values. When full, the least recently used entry is evicted.
+    """
+    __slots__ = ('max_size', 'entries', 'hits', 'misses', 'evictions')
+
+    def __init__(self,
+                 max_size: int = 1 << 16):
+        self.max_size = max_size
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return ("Entries " + str(len(self.entries)) + "/" + str(self.max_size) + ", Hits " + str(self.hits) +
+                ", Misses " + str(self.misses) + ", Evictions " + str(self.evictions))
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+    def get(self,
+            key) -> float | None:
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self,
+            key,
+            value: float):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+_worker_policy: Optional[BattlePolicy] = None
+
+
+def _init_search_worker(policy: BattlePolicy):
+    global _worker_policy
+    # workers forked from the same process would otherwise draw the same random numbers
+    random.seed()
+    seed()
+    _RNG.bit_generator.state = type(_RNG.bit_generator)().state
+    _worker_policy = policy
+
+
+def _start_pool(n_workers: int,
+                policy: BattlePolicy) -> ProcessPoolExecutor:
+    # workers are forked from a server that has preloaded this module where available
+    context = 'forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn'
+    ctx = mp.get_context(context)
+    if context == 'forkserver':
+        ctx.set_forkserver_preload([__name__])
+    return ProcessPoolExecutor(n_workers, ctx, _init_search_worker, (policy,))
+
+
+def _eval_root_actions(state: bytes,
+                       actions: list[list[BattleCommand]],
+                       opp_action: list[BattleCommand],
+                       max_depth: int,
+                       deadline: float | None) -> list[float | None]:
+    policy = _worker_policy
+    policy.max_depth = max_depth
+    if policy.table is not None:
+        policy.table.clear()
+    return policy._eval_actions(pickle.loads(state), actions, opp_action, deadline)
+
+
 class TreeSearchBattlePolicy(BattlePolicy):
     """
     Look ahead strategy that can takes into account multiple actions from our side, and the possibility of multiple
     random scenarios. However, assumes a GreedyBattlePolicy as the opponent, so it only considers one possible action
-    from the opponent and only branches the accuracy of moves.
+    from the opponent and only branches the accuracy of moves. Positions reached more than once in a decision, through
+    different accuracy outcomes or action orders, are evaluated once and looked up in a transposition table.
+
+    With n_workers > 1 our actions are split across a persistent pool of worker processes, each receiving the deduced
+    state once per decision. The pool is started on the first decision and stopped by close.
+
+    With a time_budget, in seconds, the search is anytime: depths 0, 1, ... up to max_depth are searched in turn while
+    time remains, each ordering our actions by the values of the previous one. An interrupted depth still counts if it
+    completed the previous best action. Depth 0 is always completed.
     """
 
+    class Timeout(Exception):
+        pass
+
     def __init__(self,
                  max_moves: int = 4,
                  max_depth: int = 1,
-                 params: BattleRuleParam = BattleRuleParam()):
+                 params: BattleRuleParam = BattleRuleParam(),
+                 table_size: int = 1 << 16,
+                 n_workers: int = 0,
+                 time_budget: float | None = None):
         self.max_moves = max_moves
         self.max_depth = max_depth
         self.params = params
         self.opp_policy = GreedyBattlePolicy(params)
+        self.table = TranspositionTable(table_size) if table_size > 0 else None
+        self.n_workers = n_workers
+        self.time_budget = time_budget
+        self.reached_depth = -1
+        self._pool: ProcessPoolExecutor | None = None
+        self._deadline: float | None = None
 
-    def get_states(self,
-                   state: State,
-                   action: list[BattleCommand],
-                   opp_action: list[BattleCommand]) -> list[tuple[State, float]]:
-        action = list(action)
-        states: list[tuple[State, float]] = []
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = _start_pool(self.n_workers, TreeSearchBattlePolicy(
+                params=self.params, table_size=self.table.max_size if self.table is not None else 0))
+        return self._pool
+
+    def _eval_parallel(self,
+                       state: State,
+                       actions: list[list[BattleCommand]],
+                       opp_action: list[BattleCommand],
+                       deadline: float | None = None) -> list[float | None]:
+        pool = self._get_pool()
+        _state = pickle.dumps(state)
+        n = min(self.n_workers, len(actions))
+        # actions are dealt round robin, so that the first ones in order are searched first
+        futures = [pool.submit(_eval_root_actions, _state, actions[w::n], opp_action, self.max_depth, deadline)
+                   for w in range(n)]
+        values: list[float | None] = [None] * len(actions)
+        for w, future in enumerate(futures):
+            values[w::n] = future.result()
+        return values
+
+    def _eval_actions(self,
+                      state: State,
+                      actions: list[list[BattleCommand]],
+                      opp_action: list[BattleCommand],
+                      deadline: float | None = None) -> list[float | None]:
+        # actions not evaluated before the deadline are left as None
+        if self.n_workers > 1 and len(actions) > 1:
+            return self._eval_parallel(state, actions, opp_action, deadline)
+        engine = BattleEngine(state, self.params, journal=Journal())
+        values: list[float | None] = [None] * len(actions)
+        mark = engine.checkpoint()
+        self._deadline = deadline
+        try:
+            for i, action in enumerate(actions):
+                values[i] = self.eval_action(engine, action, opp_action, 0)
+        except TreeSearchBattlePolicy.Timeout:
+            engine.rollback(mark)
+        finally:
+            self._deadline = None
+        return values
+
+    def _iterative_deepening(self,
+                             state: State,
+                             actions: list[list[BattleCommand]],
+                             opp_action: list[BattleCommand]) -> list[float]:
+        deadline = time() + self.time_budget
+        max_depth = self.max_depth
+        order = list(range(len(actions)))
+        values: list[float] = []
+        try:
+            for depth in range(max_depth + 1):
+                self.max_depth = depth
+                _values = self._eval_actions(state, [actions[i] for i in order], opp_action,
+                                             deadline if values else None)
+                if _values[0] is None:
+                    break
+                # the previous best action was searched first, so the other completed ones can be compared to it
+                values = [-float('inf')] * len(actions)
+                for i, value in zip(order, _values):
+                    if value is not None:
+                        values[i] = value
+                self.reached_depth = depth
+                if None in _values or time() >= deadline:
+                    break
+                order.sort(key=values.__getitem__, reverse=True)
+        finally:
+            self.max_depth = max_depth
+        return values
+
+    def get_outcomes(self,
+                     state: State,
+                     action: list[BattleCommand],
+                     opp_action: list[BattleCommand]) -> list[tuple[tuple[tuple[Generator, ...], tuple[Generator, ...]],
+                                                                    float]]:
+        outcomes = []
         combs = [[] for _ in range(len(action) + len(opp_action))]
         i = 0
         # iterate over all possible outcomes, setting fixed RNG and respective probabilities
@@ -185,45 +448,88 @@ class TreeSearchBattlePolicy(BattlePolicy):
             acc_rng = [[], []]
             for e in comb:
                 acc_rng[e[0]] += [e[2]]
+            outcomes += [((tuple(acc_rng[0]), tuple(acc_rng[1])), prob)]
+        return outcomes
+
+    def get_states(self,
+                   state: State,
+                   action: list[BattleCommand],
+                   opp_action: list[BattleCommand]) -> list[tuple[State, float]]:
+        action = list(action)
+        states: list[tuple[State, float]] = []
+        engine: BattleEngine | None = None
+        for acc_rng, prob in self.get_outcomes(state, action, opp_action):
             _state = copy_state(state)
-            forward(_state, (action, opp_action), self.params, acc_rng=(tuple(acc_rng[0]), tuple(acc_rng[1])))
+            # the engine is only ever bound to copies, the given state keeps its own
+            if engine is None:
+                engine = BattleEngine(_state, self.params)
+            engine.acc_rng = acc_rng
+            forward(_state, (action, opp_action), engine=engine)
             states += [(_state, prob)]
         return states
 
     def eval_action(self,
-                    state: State,
+                    engine: BattleEngine,
                     action: list[BattleCommand],
                     opp_action: list[BattleCommand],
                     depth: int = 0) -> float:
-        # predict possible states and probabilities after a turn passes
-        states = self.get_states(state, action, opp_action)
+        if self._deadline is not None and time() >= self._deadline:
+            raise TreeSearchBattlePolicy.Timeout()
+        state = engine.state
         val = 0.
         weight = 0.
-        for _state, prob in states:
+        # predict possible states and probabilities after a turn passes, each is applied in place and then rolled back
+        for acc_rng, prob in self.get_outcomes(state, action, opp_action):
+            mark = engine.checkpoint()
+            engine.acc_rng = acc_rng
+            engine.run_turn((list(action), opp_action))
             # if terminal or depth depleted we add the estimated state value
-            if _state.terminal() or depth >= self.max_depth:
-                val += prob * eval_state(_state)
+            if state.terminal() or depth >= self.max_depth:
+                val += prob * eval_state(state)
             # otherwise lookahead one more turn
             else:
-                actions = get_actions((_state.sides[0].team, _state.sides[1].team))
-                opp_action = self.opp_policy.decision(State((_state.sides[1], _state.sides[0])),
-                                                      None)  # assume greedy and single decision
-                evals = [self.eval_action(_state, action, opp_action, depth + 1) for action in actions]
-                val += prob * max(evals, default=0.)  # assuming greedy
+                val += prob * self.eval_position(engine, depth + 1)
+            engine.rollback(mark)
             weight += prob
         return 0.975 * val / weight
 
+    def eval_position(self,
+                      engine: BattleEngine,
+                      depth: int) -> float:
+        state = engine.state
+        key = None
+        if self.table is not None:
+            key = (state_key(state), self.max_depth - depth)  # remaining depth, kept between iterations
+            value = self.table.get(key)
+            if value is not None:
+                return value
+        actions = get_actions((state.sides[0].team, state.sides[1].team))
+        opp_action = self.opp_policy.decision(State((state.sides[1], state.sides[0])),
+                                              None)  # assume greedy and single decision
+        value = max((self.eval_action(engine, action, opp_action, depth) for action in actions),
+                    default=0.)  # assuming greedy
+        if key is not None:
+            self.table.put(key, value)
+        return value
+
     def decision(self,
                  state: State,
                  opp_view: Optional[TeamView] = None) -> list[BattleCommand]:
         action_eval: dict[tuple[tuple[int, int], ...], float] = {}
         # deduce initial state
         _state = deduce_state(state, opp_view, self.max_moves)
+        actions = get_actions((_state.sides[0].team, _state.sides[1].team))
+        # assume a single and greedy decision from opponent
+        opp_action = self.opp_policy.decision(State((_state.sides[1], _state.sides[0])), None)
+        if self.table is not None:
+            self.table.clear()  # keys are only valid for the States of this decision
         # iterate over all our possible actions
-        for action in get_actions((_state.sides[0].team, _state.sides[1].team)):
-            # assume a single and greedy decision from opponent
-            opp_action = self.opp_policy.decision(State((_state.sides[1], _state.sides[0])), None)
-            value = self.eval_action(_state, action, opp_action, 0)
+        if self.time_budget is None:
+            values = self._eval_actions(_state, actions, opp_action)
+            self.reached_depth = self.max_depth
+        else:
+            values = self._iterative_deepening(_state, actions, opp_action)
+        for action, value in zip(actions, values):
             key = tuple(tuple(a) for a in action)
             action_eval[key] = value
         if not action_eval:
@@ -234,6 +540,460 @@ class TreeSearchBattlePolicy(BattlePolicy):
         return list(max(action_eval, key=action_eval.get, default=0))
 
 
+# MCTSBattlePolicy
+
+def side_commands(state: State,
+                  side: int) -> list[list[BattleCommand]]:
+    team = state.sides[side].team
+    # with no usable move nor switch the engine falls back to struggle
+    return [c or [(0, 0)] for c in get_commands((team, state.sides[not side].team))]
+
+
+def hp_balance(state: State) -> float:
+    """
+    Value of a state for side 0 in [0, 1], from the fraction of total hp left on each side.
+    """
+    frac = []
+    for side in state.sides:
+        members = side.team.active + side.team.reserve
+        frac += [sum(p.hp for p in members) / sum(p.constants.stats[0] for p in members)]
+    return .5 + .5 * (frac[0] - frac[1])
+
+
+def public_hash(state: State,
+                hp_buckets: int = 8) -> int:
+    """
+    Hash of what is observed of a position: field, side conditions and, for each Pokémon told apart by side and
+    species, its place in the team and, when active, its hp in hp_buckets, status and boosts. Unlike State.hash it
+    does not depend on the hidden information deduced of the opponent or on the exact damage rolls.
+    """
+    h = zobrist.field_hash(state)
+    for side, s in enumerate(state.sides):
+        team = s.team
+        h ^= zobrist.zobrist(zobrist.SIDE_KEYS[side], zobrist.N_ACTIVE, len(team.active)) ^ zobrist.conditions_hash(
+            side, s.conditions)
+        for i, pkm in enumerate(team.active + team.reserve):
+            key = zobrist.mix(id(pkm.constants.species) << 1 | side)
+            h ^= zobrist.zobrist(key, zobrist.ORDER, i)
+            if i < len(team.active):
+                h ^= (zobrist.zobrist(key, zobrist.HP, ceil(pkm.hp * hp_buckets / pkm.constants.stats[0])) ^
+                      zobrist.flag_hash(key, zobrist.STATUS, pkm.status) ^ zobrist.boosts_hash(key, pkm.boosts))
+    return h
+
+
+def command_prior(params: BattleRuleParam,
+                  state: State,
+                  side: int,
+                  attacker: BattlingPokemon,
+                  command: BattleCommand) -> float:
+    """
+    Fraction of the target hp the command would take, switches score zero.
+    """
+    move, target = command
+    defenders = state.sides[not side].team.active
+    if not 0 <= move < len(attacker.battling_moves) or target >= len(defenders) or defenders[target].hp == 0:
+        return 0.
+    defender = defenders[target]
+    damage = calculate_damage(params, side, attacker.battling_moves[move].constants, state, attacker, defender)
+    return min(1., damage / defender.hp)
+
+
+def command_priors(params: BattleRuleParam,
+                   state: State,
+                   side: int,
+                   commands: list[list[BattleCommand]]) -> list[list[float]]:
+    return [[command_prior(params, state, side, attacker, command) for command in slot_commands]
+            for attacker, slot_commands in zip(state.sides[side].team.active, commands)]
+
+
+def _ucb(visits: list[int],
+         values: list[float],
+         priors: list[float],
+         n: int,
+         c: float,
+         bias: float) -> int:
+    if 0 in visits:
+        # ties broken at random so that Pokémon of the same side do not explore in lockstep
+        unvisited = [a for a, v in enumerate(visits) if v == 0]
+        best = max(priors[a] for a in unvisited)
+        return random.choice([a for a in unvisited if priors[a] == best])
+    log_n = log(n)
+    return max(range(len(visits)), key=lambda a: values[a] / visits[a] + c * sqrt(log_n / visits[a]) +
+               bias * priors[a] / (visits[a] + 1))
+
+
+class MCTSNode:
+    """
+    Node of a simultaneous move search tree. Each active Pokémon of each side keeps its own visits and values per
+    command, as in decoupled UCT, so that commands are chosen independently. Priors bias the selection toward the
+    commands that look best until they have been visited enough. Children are keyed by the commands chosen and the
+    hash of the position they led to, children of a root also keep the public_hash of that position.
+    """
+    __slots__ = ('commands', 'priors', 'visits', 'values', 'n', 'children', 'public')
+
+    def __init__(self,
+                 commands: tuple[list[list[BattleCommand]], list[list[BattleCommand]]],
+                 priors: tuple[list[list[float]], list[list[float]]]):
+        self.commands = commands
+        self.priors = priors
+        self.visits = tuple([[0] * len(c) for c in side] for side in commands)
+        self.values = tuple([[0.] * len(c) for c in side] for side in commands)
+        self.n = 0
+        self.children: dict[tuple[tuple[int, ...], tuple[int, ...], int], MCTSNode] = {}
+        self.public = 0
+
+    def select(self,
+               side: int,
+               c: float,
+               bias: float) -> tuple[int, ...]:
+        return tuple(_ucb(visits, values, priors, self.n, c, bias)
+                     for visits, values, priors in zip(self.visits[side], self.values[side], self.priors[side]))
+
+    def best(self) -> tuple[int, ...]:
+        return tuple(max(range(len(visits)), key=visits.__getitem__) for visits in self.visits[0])
+
+    def action(self,
+               side: int,
+               picks: tuple[int, ...]) -> list[BattleCommand]:
+        return [commands[a] for commands, a in zip(self.commands[side], picks)]
+
+    def update(self,
+               picks: tuple[tuple[int, ...], tuple[int, ...]],
+               value: float):
+        self.n += 1
+        for side, side_value in ((0, value), (1, 1. - value)):
+            for slot, a in enumerate(picks[side]):
+                self.visits[side][slot][a] += 1
+                self.values[side][slot][a] += side_value
+
+
+class MCTSBattlePolicy(BattlePolicy):
+    """
+    Simultaneous move Monte Carlo tree search over a deduced state. The commands of each active Pokémon, on both sides,
+    are picked independently with UCB1 on their own statistics (decoupled UCT), plus a bias of weight bias toward the
+    commands that deal the most damage that fades as they are visited. Turns are applied in place and rolled
+    back, new nodes are valued by a rollout of rollout_turns with rollout_policy, scored by the winner or else by
+    hp_balance. A single rollout turn of the greedy policy values positions better than hp_balance alone. Runs
+    n_iterations, or as many as fit in time_budget seconds when given. With reuse_tree, the subtree reached by our last
+    action whose public_hash matches the position observed on the next decision is kept as the new root.
+    """
+
+    def __init__(self,
+                 n_iterations: int = 1000,
+                 time_budget: float | None = None,
+                 rollout_turns: int = 1,
+                 c: float = .5,
+                 bias: float = 1.,
+                 max_moves: int = 4,
+                 params: BattleRuleParam = BattleRuleParam(),
+                 rollout_policy: BattlePolicy | None = None,
+                 reuse_tree: bool = True):
+        self.n_iterations = n_iterations
+        self.time_budget = time_budget
+        self.rollout_turns = rollout_turns
+        self.c = c
+        self.bias = bias
+        self.max_moves = max_moves
+        self.params = params
+        self.rollout_policy = rollout_policy if rollout_policy is not None else GreedyBattlePolicy(params)
+        self.reuse_tree = reuse_tree
+        self.iterations = 0
+        self._root: MCTSNode | None = None
+        self._last_picks: tuple[int, ...] = ()
+
+    def _value(self,
+               engine: BattleEngine) -> float:
+        if engine.winning_side != -1:
+            return float(engine.winning_side == 0)
+        return hp_balance(engine.state)
+
+    def _new_node(self,
+                  state: State) -> MCTSNode:
+        commands = side_commands(state, 0), side_commands(state, 1)
+        return MCTSNode(commands, (command_priors(self.params, state, 0, commands[0]),
+                                   command_priors(self.params, state, 1, commands[1])))
+
+    def _rollout(self,
+                 engine: BattleEngine) -> float:
+        state = engine.state
+        for _ in range(self.rollout_turns):
+            if engine.finished():
+                break
+            engine.run_turn((self.rollout_policy.decision(state),
+                             self.rollout_policy.decision(State((state.sides[1], state.sides[0])))))
+        return self._value(engine)
+
+    def _iterate(self,
+                 engine: BattleEngine,
+                 root: MCTSNode):
+        state = engine.state
+        node = root
+        path: list[tuple[MCTSNode, tuple[tuple[int, ...], tuple[int, ...]]]] = []
+        while True:
+            if engine.finished():
+                value = self._value(engine)
+                break
+            picks = node.select(0, self.c, self.bias), node.select(1, self.c, self.bias)
+            engine.run_turn((node.action(0, picks[0]), node.action(1, picks[1])))
+            path += [(node, picks)]
+            key = picks[0], picks[1], state.hash
+            child = node.children.get(key)
+            if child is None:
+                if not engine.finished():
+                    node.children[key] = child = self._new_node(state)
+                    if node is root:
+                        child.public = public_hash(state)
+                value = self._rollout(engine)
+                break
+            node = child
+        for node, picks in path:
+            node.update(picks, value)
+
+    def _get_root(self,
+                  state: State) -> MCTSNode:
+        if self.reuse_tree and self._root is not None:
+            h = public_hash(state)
+            children = [child for (picks, _, _), child in self._root.children.items()
+                        if picks == self._last_picks and child.public == h]
+            child = max(children, key=lambda x: x.n, default=None)
+            if child is not None and child.commands == (side_commands(state, 0), side_commands(state, 1)):
+                return child
+        return self._new_node(state)
+
+    def decision(self,
+                 state: State,
+                 opp_view: Optional[TeamView] = None) -> list[BattleCommand]:
+        _state = deduce_state(state, opp_view, self.max_moves) if opp_view is not None else copy_state(state)
+        engine = BattleEngine(_state, self.params, journal=Journal())
+        engine.track_hash()  # children are keyed by the hash of the positions reached
+        root = self._get_root(_state)
+        deadline = time() + self.time_budget if self.time_budget is not None else None
+        self.iterations = 0
+        while (self.iterations < self.n_iterations) if deadline is None else (time() < deadline):
+            mark = engine.checkpoint()
+            self._iterate(engine, root)
+            engine.rollback(mark)
+            self.iterations += 1
+        picks = root.best()
+        self._root, self._last_picks = root, picks
+        return root.action(0, picks)
+
+
+# ISMCTSBattlePolicy
+
+CommandKey = tuple[Move | None, int] | tuple[None, Pokemon]
+
+
+def command_key(team: BattlingTeam,
+                attacker: BattlingPokemon,
+                command: BattleCommand) -> CommandKey:
+    """
+    What a command does rather than the slot it uses, the move used and its target or the Pokémon switched in, as the
+    hidden moves and reserve of the opponent fill different slots in each determinization.
+    """
+    move, target = command
+    if move < 0:
+        return None, team.reserve[target].constants
+    if move < len(attacker.battling_moves):
+        return attacker.battling_moves[move].constants, target
+    return None, target
+
+
+def _ismcts_ucb(entries: list[list],
+                c: float,
+                bias: float) -> int:
+    # entries are [command, visits, summed value, availability, prior]
+    unvisited = [i for i, e in enumerate(entries) if e[1] == 0]
+    if unvisited:
+        best = max(entries[i][4] for i in unvisited)
+        return random.choice([i for i in unvisited if entries[i][4] == best])
+    return max(range(len(entries)), key=lambda i: entries[i][2] / entries[i][1] +
+               c * sqrt(log(entries[i][3]) / entries[i][1]) + bias * entries[i][4] / (entries[i][1] + 1))
+
+
+class ISMCTSNode:
+    """
+    Node of an information set search tree, shared by all determinizations. A node stands for the commands played from
+    the root, whatever the hidden information and chance outcomes were. Each active Pokémon of each side keeps, per
+    command_key, the command it was first met as, its visits, summed values, availability (the times it could have
+    been chosen) and prior. Commands that only exist in some determinizations, as the hidden moves of the opponent, are
+    added when first met.
+    """
+    __slots__ = ('stats', 'children')
+
+    def __init__(self):
+        self.stats: tuple[list[dict[CommandKey, list]], list[dict[CommandKey, list]]] = ([], [])
+        self.children: dict[tuple[tuple[CommandKey, ...], tuple[CommandKey, ...]], ISMCTSNode] = {}
+
+    def select(self,
+               params: BattleRuleParam,
+               state: State,
+               side: int,
+               c: float,
+               bias: float) -> tuple[tuple[CommandKey, ...], list[BattleCommand]]:
+        # the chosen keys and the commands they stand for in this determinization
+        stats = self.stats[side]
+        team = state.sides[side].team
+        commands = side_commands(state, side)
+        stats += [{} for _ in range(len(commands) - len(stats))]
+        keys, action = [], []
+        for attacker, slot_commands, slot_stats in zip(team.active, commands, stats):
+            slot_keys, entries = [], []
+            for command in slot_commands:
+                key = command_key(team, attacker, command)
+                entry = slot_stats.get(key)
+                if entry is None:
+                    entry = slot_stats[key] = [command, 0, 0., 0, command_prior(params, state, side, attacker,
+                                                                                command)]
+                entry[3] += 1
+                slot_keys += [key]
+                entries += [entry]
+            i = _ismcts_ucb(entries, c, bias)
+            keys += [slot_keys[i]]
+            action += [slot_commands[i]]
+        return tuple(keys), action
+
+    def update(self,
+               keys: tuple[tuple[CommandKey, ...], tuple[CommandKey, ...]],
+               value: float):
+        for side, side_value in ((0, value), (1, 1. - value)):
+            for slot_stats, key in zip(self.stats[side], keys[side]):
+                entry = slot_stats[key]
+                entry[1] += 1
+                entry[2] += side_value
+
+    def own_stats(self) -> list[dict[BattleCommand, list]]:
+        # our own commands are the same in every determinization, so they can stand for their keys
+        return [{entry[0]: entry for entry in slot_stats.values()} for slot_stats in self.stats[0]]
+
+
+def _ismcts_search(states: bytes,
+                   n_iterations: int,
+                   deadline: float | None) -> tuple[list[dict[BattleCommand, list]], int]:
+    policy = _worker_policy
+    root = policy._search(pickle.loads(states), n_iterations, deadline)
+    return root.own_stats(), policy.iterations
+
+
+class ISMCTSBattlePolicy(MCTSBattlePolicy):
+    """
+    Information set Monte Carlo tree search. A batch of n_determinizations states is deduced from the opponent view
+    once per decision, and iterations take them in turn down a single tree whose nodes stand for the commands played,
+    so that what is learnt under one completion of the hidden information is shared by all. Commands are picked per
+    active Pokémon with UCB1 over the times they were available, biased by priors, and leaves are valued as in
+    MCTSBattlePolicy. Trees are not reused between decisions.
+
+    With n_workers > 1 the determinizations and iterations are split across a persistent pool of worker processes,
+    each growing its own tree, and the root statistics of the trees are summed. The pool is started on the first
+    decision and stopped by close.
+    """
+
+    def __init__(self,
+                 n_iterations: int = 1000,
+                 time_budget: float | None = None,
+                 n_determinizations: int = 32,
+                 rollout_turns: int = 1,
+                 c: float = .5,
+                 bias: float = 1.,
+                 max_moves: int = 4,
+                 params: BattleRuleParam = BattleRuleParam(),
+                 rollout_policy: BattlePolicy | None = None,
+                 n_workers: int = 0):
+        super().__init__(n_iterations, time_budget, rollout_turns, c, bias, max_moves, params, rollout_policy, False)
+        self.n_determinizations = n_determinizations
+        self.n_workers = n_workers
+        self._pool: ProcessPoolExecutor | None = None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = _start_pool(self.n_workers, ISMCTSBattlePolicy(
+                rollout_turns=self.rollout_turns, c=self.c, bias=self.bias, params=self.params,
+                rollout_policy=self.rollout_policy))
+        return self._pool
+
+    def _iterate(self,
+                 engine: BattleEngine,
+                 root: ISMCTSNode):
+        state = engine.state
+        node = root
+        path: list[tuple[ISMCTSNode, tuple[tuple[CommandKey, ...], tuple[CommandKey, ...]]]] = []
+        while True:
+            if engine.finished():
+                value = self._value(engine)
+                break
+            keys0, action0 = node.select(self.params, state, 0, self.c, self.bias)
+            keys1, action1 = node.select(self.params, state, 1, self.c, self.bias)
+            engine.run_turn((action0, action1))
+            keys = keys0, keys1
+            path += [(node, keys)]
+            child = node.children.get(keys)
+            if child is None:
+                if not engine.finished():
+                    node.children[keys] = ISMCTSNode()
+                value = self._rollout(engine)
+                break
+            node = child
+        for node, keys in path:
+            node.update(keys, value)
+
+    def _search(self,
+                states: list[State],
+                n_iterations: int,
+                deadline: float | None) -> ISMCTSNode:
+        engines = [BattleEngine(state, self.params, journal=Journal()) for state in states]
+        root = ISMCTSNode()
+        self.iterations = 0
+        while (self.iterations < n_iterations) if deadline is None else (time() < deadline):
+            engine = engines[self.iterations % len(engines)]
+            mark = engine.checkpoint()
+            self._iterate(engine, root)
+            engine.rollback(mark)
+            self.iterations += 1
+        return root
+
+    def _search_parallel(self,
+                         states: list[State],
+                         deadline: float | None) -> list[dict[BattleCommand, list]]:
+        pool = self._get_pool()
+        n = min(self.n_workers, len(states))
+        futures = [pool.submit(_ismcts_search, pickle.dumps(states[w::n]), -(-self.n_iterations // n), deadline)
+                   for w in range(n)]
+        stats: list[dict[BattleCommand, list]] = []
+        self.iterations = 0
+        for future in futures:
+            worker_stats, iterations = future.result()
+            self.iterations += iterations
+            stats += [{} for _ in range(len(worker_stats) - len(stats))]
+            for slot_stats, worker_slot_stats in zip(stats, worker_stats):
+                for command, entry in worker_slot_stats.items():
+                    if command in slot_stats:
+                        slot_stats[command][1] += entry[1]
+                    else:
+                        slot_stats[command] = entry
+        return stats
+
+    def decision(self,
+                 state: State,
+                 opp_view: Optional[TeamView] = None) -> list[BattleCommand]:
+        if opp_view is not None:
+            states = deduce_states(state, opp_view, self.max_moves, self.n_determinizations)
+        else:
+            states = [copy_state(state)]
+        deadline = time() + self.time_budget if self.time_budget is not None else None
+        if self.n_workers > 1 and len(states) > 1:
+            stats = self._search_parallel(states, deadline)
+        else:
+            stats = self._search(states, self.n_iterations, deadline).own_stats()
+        if not stats:
+            return [commands[0] for commands in side_commands(states[0], 0)]
+        return [max(slot_stats.values(), key=lambda e: e[1])[0] for slot_stats in stats]
+
+
 # TerminalBattle
 
 def select(max_action: int):
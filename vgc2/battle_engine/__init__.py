@@ -5,6 +5,8 @@ from vgc2.battle_engine.constants import BattleRuleParam
 from vgc2.battle_engine.damage_calculator import calculate_damage, calculate_poison_damage, calculate_sand_damage, \
     calculate_burn_damage, calculate_stealth_rock_damage
 from vgc2.battle_engine.game_state import State, Side
+from vgc2.battle_engine.debug import DebugInfo
+from vgc2.battle_engine.journal import Journal
 from vgc2.battle_engine.modifiers import Weather, Terrain, Hazard, Status, Category, Type
 from vgc2.battle_engine.move import Move, BattlingMove
 from vgc2.battle_engine.pokemon import BattlingPokemon
@@ -12,6 +14,7 @@ from vgc2.battle_engine.priority_calculator import priority_calculator
 from vgc2.battle_engine.team import Team, BattlingTeam
 from vgc2.battle_engine.threshold_calculator import paralysis_threshold, move_hit_threshold, thaw_threshold
 from vgc2.battle_engine.view import StateView, TeamView
+from vgc2.battle_engine import zobrist
 
 BattleCommand = tuple[int, int]  # action, target
 FullCommand = tuple[list[BattleCommand], list[BattleCommand]]
@@ -20,12 +23,12 @@ _RNG = default_rng()
 STRUGGLE = BattlingMove(Move(Type.TYPELESS, 50, 1., 0, Category.PHYSICAL, recoil=.5))
 
 
-class BattleEngine:  # TODO Debug mode
+class BattleEngine:
     class TeamFainted(Exception):
         pass
 
     __slots__ = ('state', 'params', 'winning_side', 'acc_rng', 'eff_rng', 'sta_rng', '_move_queue', '_switch_queue',
-                 'turn_limit', 'turn')
+                 '_move_priority', 'turn_limit', 'turn', 'journal', 'debug', '_hashing', '_switching')
 
     def __init__(self,
                  state: State,
@@ -33,7 +36,9 @@ class BattleEngine:  # TODO Debug mode
                  acc_rng: tuple[tuple[Generator, ...], tuple[Generator, ...]] = ((_RNG, _RNG), (_RNG, _RNG)),
                  eff_rng: tuple[tuple[Generator, ...], tuple[Generator, ...]] = ((_RNG, _RNG), (_RNG, _RNG)),
                  sta_rng: tuple[tuple[Generator, ...], tuple[Generator, ...]] = ((_RNG, _RNG), (_RNG, _RNG)),
-                 turn_limit: int = 100):
+                 turn_limit: int = 100,
+                 journal: Journal | None = None,
+                 debug: DebugInfo | None = None):
         self.state = state
         self.params = params
         self.acc_rng = acc_rng
@@ -42,34 +47,119 @@ class BattleEngine:  # TODO Debug mode
         self.winning_side: int = -1
         self._move_queue: list[tuple[int, BattlingPokemon, BattlingMove, list[BattlingPokemon]]] = []
         self._switch_queue: list[tuple[int, int, int]] = []
+        self._move_priority: list[float] = []
+        self._hashing = False
         self._set_state_engine()
         self.turn_limit = turn_limit
         self.turn = 0
+        self.journal = journal
+        self.debug = debug
+        self._switching: tuple[int, int, int] | None = None
 
     def __str__(self):
         return str(self.state)
 
     def _set_state_engine(self):
-        for s in self.state.sides:
+        for side, s in enumerate(self.state.sides):
             s.team._engine = self
+            s.team._index()
             for p in s.team.active + s.team.reserve:
                 p._engine = self
+                if self._hashing:
+                    p._key = zobrist.pokemon_key(side, p)
+        if self._hashing:
+            self.state.rehash()
+
+    def track_hash(self):
+        """
+        Keep State.hash up to date incrementally on every change from now on, also for the States this engine is bound
+        to later. Until then the engine does no hashing work and drops the hash on each turn, to be recomputed when
+        read.
+        """
+        if not self._hashing:
+            self._hashing = True
+            self._set_state_engine()
+
+    def bind(self,
+             state: State):
+        """
+        Reuse this engine on another State, params, RNG sources and turn limit are kept.
+        """
+        if state is not self.state or state.sides[0].team._engine is not self:
+            self.state = state
+            self._set_state_engine()
+        self.winning_side = -1
+        self._move_queue = []
+        self._switch_queue = []
+        self._move_priority = []
+        self.turn = 0
+        if self.journal is not None:
+            self.journal.clear()
 
     def reset(self):
         self.state.reset()
         self.winning_side = -1
         self._move_queue = []
         self._switch_queue = []
+        self._move_priority = []
         self.turn = 0
 
+    def checkpoint(self) -> int:
+        """
+        Start journaling if needed and return a mark to which the state can be rolled back.
+        """
+        if self.journal is None:
+            self.journal = Journal()
+        mark = self.journal.mark()
+        self.journal.record(self, 'turn', 'winning_side')
+        self.journal.record(self.state, '_hash')
+        self.journal.record_copy(self, '_move_queue')
+        self.journal.record_copy(self, '_move_priority')
+        self.journal.record_copy(self, '_switch_queue')
+        return mark
+
+    def rollback(self,
+                 mark: int):
+        self.journal.undo(mark)
+
+    def _log(self,
+             obj,
+             *attrs: str):
+        if self.journal is not None:
+            self.journal.record(obj, *attrs)
+
+    def _set_flag(self,
+                  obj,
+                  attr: str,
+                  key: int,
+                  feature: int,
+                  value):
+        # logged and hashed assignment of a flag like feature
+        self._log(obj, attr)
+        if self._hashing:
+            self.state._hash ^= (zobrist.flag_hash(key, feature, getattr(obj, attr)) ^
+                                 zobrist.flag_hash(key, feature, value))
+        setattr(obj, attr, value)
+
     def run_turn(self,
                  commands: FullCommand):
+        if not self._hashing:
+            self.state._hash = None
+        elif self.state._hash is None:
+            self.state.rehash()
         self.turn += 1
         self._set_action_queue(commands)
+        if self.debug is not None:
+            self.debug.event('turn', self.turn, commands)
         try:
-            self._perform_switches()
-            self._perform_moves()
-            self._end_of_turn_state_effects()
+            if self.debug is None:
+                self._perform_switches()
+                self._perform_moves()
+                self._end_of_turn_state_effects()
+            else:
+                self.debug.time('switches', self._perform_switches)
+                self.debug.time('moves', self._perform_moves)
+                self.debug.time('end_of_turn', self._end_of_turn_state_effects)
             if self.turn >= self.turn_limit:
                 self.winning_side = int(self.state.sides[0].team.tie_breaker() > self.state.sides[1].team.tie_breaker())
                 return
@@ -80,7 +170,29 @@ class BattleEngine:  # TODO Debug mode
             if team0_fainted and not team1_fainted:
                 self.winning_side = 1
             return
-        self.state._on_turn_end(self.params)
+        if self.journal is not None:
+            self._log_turn_end()
+        h = self.state._hash ^ zobrist.turn_end_hash(self.state) if self._hashing else 0
+        if self.debug is None:
+            self.state._on_turn_end(self.params)
+        else:
+            weather, field = self.state.weather, self.state.field
+            self.state._on_turn_end(self.params)
+            if self.state.weather != weather:
+                self.debug.event('weather', self.state.weather)
+            if self.state.field != field:
+                self.debug.event('field', self.state.field)
+        if self._hashing:
+            self.state._hash = h ^ zobrist.turn_end_hash(self.state)
+
+    def _log_turn_end(self):
+        self.journal.record(self.state, 'weather', '_weather_turns', 'field', '_field_turns', 'trickroom',
+                            '_trickroom_turns')
+        for side in self.state.sides:
+            self.journal.record(side.conditions, 'reflect', '_reflect_turns', 'lightscreen', '_lightscreen_turns',
+                                'tailwind', '_tailwind_turns')
+            for pkm in side.team.active:
+                self.journal.record(pkm, 'protect', '_consecutive_protect', '_wake_turns')
 
     def finished(self) -> bool:
         return self.state.terminal() or self.turn >= self.turn_limit
@@ -98,20 +210,29 @@ class BattleEngine:  # TODO Debug mode
                         raise Exception('Invalid Game State: Pokemon with 0 moves.')
                     self._move_queue += [(side, user, user.battling_moves[a[0]],
                                           [def_act[a[1] if a[1] < len(def_act) else 0]])]
+                    self._move_priority += [0.]
                 else:
                     self._switch_queue += [(side, i, a[1])]
 
     def _perform_switches(self):
         while len(self._switch_queue) > 0:
             side, active, reserve = self._switch_queue.pop()
-            self.state.sides[side].team.switch(active, reserve)
+            self._switch(side, active, reserve)
+
+    def _prioritize(self,
+                    pkm: BattlingPokemon | None = None):
+        # priorities are kept aligned with the move queue and only recomputed for actors whose speed may have changed
+        for i, a in enumerate(self._move_queue):
+            if pkm is None or a[1] is pkm:
+                self._move_priority[i] = priority_calculator(self.params, a[2].constants, a[1], self.state)
 
     def _perform_moves(self):
+        self._prioritize()
         while len(self._move_queue) > 0:
             # determine next move
-            side, attacker, _move, defenders = (
-                self._move_queue.pop(max(enumerate([priority_calculator(self.params, a[2].constants, a[1], self.state)
-                                                    for a in self._move_queue]), key=lambda x: x[1])[0]))
+            i = max(range(len(self._move_priority)), key=self._move_priority.__getitem__)
+            self._move_priority.pop(i)
+            side, attacker, _move, defenders = self._move_queue.pop(i)
             # before each move check if Pokémon can attack due status or have its status removed
             pos = self.state.sides[side].team.get_active_pos(attacker)
             if self._perform_status(attacker, side, pos, _move.constants):
@@ -122,8 +243,15 @@ class BattleEngine:  # TODO Debug mode
                 _move = next(m for m in attacker.battling_moves if m.pp > 0 and not m.disabled)
             damage, protected, failed = 0, False, True
             if _move != STRUGGLE:
+                self._log(_move, 'pp')
+                if _move.pp > 0 and self._hashing:
+                    i = zobrist.PP + attacker.battling_moves.index(_move)
+                    self.state._hash ^= (zobrist.zobrist(attacker._key, i, _move.pp) ^
+                                         zobrist.zobrist(attacker._key, i, _move.pp - 1))
                 _move.pp = max(0, _move.pp - 1)
                 attacker.on_move_used(_move)
+            if self.debug is not None:
+                self.debug.event('move', side, attacker, _move)
             for defender in defenders:
                 if defender.protect:
                     protected = True
@@ -134,14 +262,16 @@ class BattleEngine:  # TODO Debug mode
                 failed = False
                 # perform next move, damaged is applied first and then effects, unless opponent protected itself
                 damage = calculate_damage(self.params, side, _move.constants, self.state, attacker, defender)
-                defender.deal_damage(damage)
+                if self.debug is not None:
+                    self.debug.event('damage', attacker, _move, defender, damage)
+                self._deal_damage(defender, damage)
                 if defender.fainted():
                     continue
                 if self.eff_rng[side][pos].random() < _move.constants.effect_prob:
                     self._perform_target_effects(_move.constants, side, defender)
                 # a fire move will thaw a frozen target
                 if _move.constants.pkm_type == Type.FIRE and damage > 0 and defender.status == Status.FROZEN:
-                    defender.status = Status.NONE
+                    self._set_status(not side, defender, Status.NONE)
             if not protected and not failed and self.eff_rng[side][pos].random() < _move.constants.effect_prob:
                 self._perform_single_effects(_move.constants, side, attacker, damage)
 
@@ -156,12 +286,12 @@ class BattleEngine:  # TODO Debug mode
                     return True
             case Status.SLEEP:
                 if attacker._wake_turns == 0:
-                    attacker.status = Status.NONE
+                    self._set_status(side, attacker, Status.NONE)
                 else:
                     return True
             case Status.FROZEN:
                 if _move.pkm_type == Type.FIRE or self.sta_rng[side][pos].random() < thaw_threshold(self.params):
-                    attacker.status = Status.NONE
+                    self._set_status(side, attacker, Status.NONE)
                 else:
                     return True
         return False
@@ -171,38 +301,56 @@ class BattleEngine:  # TODO Debug mode
                                 side: int,
                                 attacker: BattlingPokemon,
                                 damage: float):
+        conditions = self.state.sides[side].conditions
         # State changes
         if _move.weather_start != Weather.CLEAR and _move.weather_start != self.state.weather:
-            self.state.weather = _move.weather_start
+            self._set_flag(self.state, 'weather', zobrist.STATE_KEY, zobrist.WEATHER, _move.weather_start)
+            if self.debug is not None:
+                self.debug.event('weather', self.state.weather)
         elif _move.field_start != Terrain.NONE and _move.field_start != self.state.field:
-            self.state.field = _move.field_start
+            self._set_flag(self.state, 'field', zobrist.STATE_KEY, zobrist.FIELD, _move.field_start)
+            if self.debug is not None:
+                self.debug.event('field', self.state.field)
         elif _move.toggle_trickroom and not self.state.trickroom:
-            self.state.trickroom = True
+            self._set_flag(self.state, 'trickroom', zobrist.STATE_KEY, zobrist.TRICKROOM, True)
+            self._prioritize()
         # Side conditions changes
-        elif _move.toggle_lightscreen and not self.state.sides[side].conditions.lightscreen:
-            self.state.sides[side].conditions.lightscreen = True
-        elif _move.toggle_reflect and not self.state.sides[side].conditions.reflect:
-            self.state.sides[side].conditions.reflect = True
-        elif _move.toggle_tailwind and not self.state.sides[side].conditions.tailwind:
-            self.state.sides[side].conditions.tailwind = True
+        elif _move.toggle_lightscreen and not conditions.lightscreen:
+            self._set_flag(conditions, 'lightscreen', zobrist.SIDE_KEYS[side], zobrist.LIGHTSCREEN, True)
+        elif _move.toggle_reflect and not conditions.reflect:
+            self._set_flag(conditions, 'reflect', zobrist.SIDE_KEYS[side], zobrist.REFLECT, True)
+        elif _move.toggle_tailwind and not conditions.tailwind:
+            self._set_flag(conditions, 'tailwind', zobrist.SIDE_KEYS[side], zobrist.TAILWIND, True)
         elif _move.hazard == Hazard.STEALTH_ROCK:
-            self.state.sides[side].conditions.stealth_rock = True
+            self._set_flag(conditions, 'stealth_rock', zobrist.SIDE_KEYS[side], zobrist.STEALTH_ROCK, True)
         elif _move.hazard == Hazard.TOXIC_SPIKES:
-            self.state.sides[side].conditions.poison_spikes = True
+            self._set_flag(conditions, 'poison_spikes', zobrist.SIDE_KEYS[side], zobrist.POISON_SPIKES, True)
         # Pokémon effects
         elif _move.heal > 0:
-            attacker.recover(int(damage * _move.heal))
+            self._log(attacker, 'hp')
+            if self._hashing:
+                max_hp = attacker.constants.stats[0]
+                self.state._hash ^= zobrist.hp_hash(attacker._key, attacker.hp, max_hp)
+                attacker.recover(int(damage * _move.heal))
+                self.state._hash ^= zobrist.hp_hash(attacker._key, attacker.hp, max_hp)
+            else:
+                attacker.recover(int(damage * _move.heal))
+            # after healing, so that the event carries the hp left as damage events do
+            if self.debug is not None:
+                self.debug.event('recover', side, attacker, int(damage * _move.heal))
         elif _move.recoil > 0:
-            attacker.deal_damage(int(damage * _move.recoil))
+            self._deal_damage(attacker, int(damage * _move.recoil))
         elif _move.self_switch:
-            self.state.sides[side].team.switch(self.state.sides[side].team.get_active_pos(attacker),
-                                               self.state.sides[side].team.first_from_reserve())
+            self._switch(side, self.state.sides[side].team.get_active_pos(attacker),
+                         self.state.sides[side].team.first_from_reserve())
         elif _move.change_type:
+            self._log(attacker, 'types')
             attacker.types = [attacker.battling_moves[0].constants.pkm_type]
         elif _move.self_boosts and any(b != 0 for b in _move.boosts):
-            attacker.boosts = clip([_b + b for _b, b in zip(attacker.boosts, _move.boosts)], a_min=-6, a_max=6).tolist()
+            self._log(attacker, 'boosts')
+            self._set_boosts(attacker, _move.boosts)
         elif _move.protect:
-            attacker.protect = True
+            self._set_flag(attacker, 'protect', attacker._key, zobrist.PROTECT, True)
 
     def _perform_target_effects(self,
                                 _move: Move,
@@ -210,48 +358,139 @@ class BattleEngine:  # TODO Debug mode
                                 defender: BattlingPokemon):
         # Pokémon effects
         if _move.status != Status.NONE and defender.status == Status.NONE:
-            defender.status = _move.status
+            self._set_status(not side, defender, _move.status)
+            if defender.status == Status.PARALYZED:
+                self._prioritize(defender)
         # Move Effects
         elif _move.disable and not any(
                 m.disabled for m in defender.battling_moves) and defender.last_used_move is not None:
+            self._log(defender.last_used_move, 'disabled')
             defender.last_used_move.disabled = True
+            if self._hashing:
+                i = defender.battling_moves.index(defender.last_used_move)
+                self.state._hash ^= zobrist.zobrist(defender._key, zobrist.DISABLED + i, 1)
         elif _move.force_switch:
-            self.state.sides[not side].team.switch(self.state.sides[not side].team.get_active_pos(defender),
-                                                   self.state.sides[not side].team.first_from_reserve())
+            self._switch(not side, self.state.sides[not side].team.get_active_pos(defender),
+                         self.state.sides[not side].team.first_from_reserve())
         elif not _move.self_boosts and any(b != 0 for b in _move.boosts):
-            defender.boosts = clip([_b + b for _b, b in zip(defender.boosts, _move.boosts)], a_min=-6, a_max=6).tolist()
+            self._log(defender, 'boosts')
+            self._set_boosts(defender, _move.boosts)
 
     def _end_of_turn_state_effects(self):
         all_active = self.state.sides[0].team.active + self.state.sides[1].team.active
         for pkm in all_active:
             if pkm.status == Status.POISON:
-                pkm.deal_damage(calculate_poison_damage(self.params, pkm))
+                self._deal_damage(pkm, calculate_poison_damage(self.params, pkm))
         for pkm in all_active:
             if pkm.status == Status.BURN:
-                pkm.deal_damage(calculate_burn_damage(self.params, pkm))
+                self._deal_damage(pkm, calculate_burn_damage(self.params, pkm))
         for pkm in all_active:
             if self.state.weather == Weather.SAND:
-                pkm.deal_damage(calculate_sand_damage(self.params, pkm))
+                self._deal_damage(pkm, calculate_sand_damage(self.params, pkm))
+
+    def _deal_damage(self,
+                     pkm: BattlingPokemon,
+                     damage: float):
+        self._log(pkm, 'hp')
+        side = self.state.get_side(pkm)
+        if self.debug is not None:
+            self.debug.event('deal_damage', side, pkm, damage)
+        # hashed before fainting may switch the Pokémon out or end the battle
+        if self._hashing:
+            max_hp = pkm.constants.stats[0]
+            old, new = zobrist.hp_bucket(pkm.hp, max_hp), zobrist.hp_bucket(max(0, pkm.hp - damage), max_hp)
+            if old != new:
+                self.state._hash ^= (zobrist.zobrist(pkm._key, zobrist.HP, old) ^
+                                     zobrist.zobrist(pkm._key, zobrist.HP, new))
+        pkm.deal_damage(damage)
+
+    def _set_status(self,
+                    side: int,
+                    pkm: BattlingPokemon,
+                    status: Status):
+        self._set_flag(pkm, 'status', pkm._key, zobrist.STATUS, status)
+        if self.debug is not None:
+            self.debug.event('status', side, pkm, status)
+
+    def _set_boosts(self,
+                    pkm: BattlingPokemon,
+                    boosts: list[int]):
+        if self._hashing:
+            self.state._hash ^= zobrist.boosts_hash(pkm._key, pkm.boosts)
+        pkm.boosts = clip([_b + b for _b, b in zip(pkm.boosts, boosts)], a_min=-6, a_max=6).tolist()
+        if self._hashing:
+            self.state._hash ^= zobrist.boosts_hash(pkm._key, pkm.boosts)
+        self._prioritize(pkm)
+
+    @staticmethod
+    def _switch_out_hash(pkm: BattlingPokemon) -> int:
+        # features a Pokémon may lose when switching out
+        return (zobrist.boosts_hash(pkm._key, pkm.boosts) ^ zobrist.flag_hash(pkm._key, zobrist.PROTECT, pkm.protect) ^
+                zobrist.disabled_hash(pkm._key, pkm.battling_moves))
+
+    def _switch(self,
+                side: int,
+                active_pos: int,
+                reserve_pos: int):
+        team = self.state.sides[side].team
+        if 0 <= active_pos < len(team.active):
+            pkm = team.active[active_pos]
+            if self.journal is not None:
+                self.journal.record_copy(team, 'active')
+                self.journal.record_copy(team, 'reserve')
+                self.journal.record(pkm, 'boosts', 'last_used_move', 'protect')
+                for move in pkm.battling_moves:
+                    self.journal.record(move, 'disabled')
+            if self._hashing:
+                # completed in _on_switch, if the switch takes place
+                self._switching = (side, active_pos, self._switch_out_hash(pkm))
+        team.switch(active_pos, reserve_pos)
+        self._switching = None
 
     def _on_fainted(self,
                     pkm: BattlingPokemon):
         side = self.state.get_side(pkm)
+        if self.debug is not None:
+            self.debug.event('faint', side, pkm)
         if self.state.sides[side].team.fainted():
             raise BattleEngine.TeamFainted()
-        self.state.sides[side].team.switch(self.state.sides[side].team.get_active_pos(pkm),
-                                           self.state.sides[side].team.first_from_reserve())
+        self._switch(side, self.state.sides[side].team.get_active_pos(pkm),
+                     self.state.sides[side].team.first_from_reserve())
 
     def _on_switch(self,
                    switch_in: BattlingPokemon | None,
                    switch_out: BattlingPokemon):
+        if self._switching is not None:
+            side, active_pos, h = self._switching
+            self._switching = None
+            h ^= self._switch_out_hash(switch_out)
+            team = self.state.sides[side].team
+            if switch_in:
+                # the two Pokémon traded positions
+                reserve_pos = len(team.active) + team.reserve.index(switch_out)
+                for key in (switch_in._key, switch_out._key):
+                    h ^= (zobrist.zobrist(key, zobrist.ORDER, active_pos) ^
+                          zobrist.zobrist(key, zobrist.ORDER, reserve_pos))
+            else:
+                # the fainted Pokémon was moved from the actives to the end of the reserve
+                n_active = len(team.active)
+                before = team.active[:active_pos] + [switch_out] + team.active[active_pos:] + team.reserve[:-1]
+                h ^= (zobrist.order_hash(side, n_active + 1, before) ^
+                      zobrist.order_hash(side, n_active, team.active + team.reserve))
+            self.state._hash ^= h
         # if a Pokémon switches out it will no longer perform its moves
-        self._move_queue = [a for a in self._move_queue if a[1] != switch_out]
+        if any(a[1] is switch_out for a in self._move_queue):
+            keep = [i for i, a in enumerate(self._move_queue) if a[1] is not switch_out]
+            self._move_queue = [self._move_queue[i] for i in keep]
+            self._move_priority = [self._move_priority[i] for i in keep]
+        if self.debug is not None:
+            self.debug.event('switch', self.state.get_side(switch_out), switch_in, switch_out)
         # hazards
         if not switch_in:
             return
         side = self.state.get_side(switch_in)
         if (self.state.sides[side].conditions.poison_spikes and Type.POISON not in switch_in.types and
                 Type.STEEL not in switch_in.types and switch_in.status == Status.NONE):
-            switch_in.status = Status.POISON
+            self._set_status(side, switch_in, Status.POISON)
         if self.state.sides[side].conditions.stealth_rock:
-            switch_in.deal_damage(calculate_stealth_rock_damage(self.params, switch_in))
+            self._deal_damage(switch_in, calculate_stealth_rock_damage(self.params, switch_in))
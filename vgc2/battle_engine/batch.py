@@ -0,0 +1,762 @@
+import numpy as np
+from numpy.random import Generator
+
+from vgc2.battle_engine import STRUGGLE, _RNG
+from vgc2.battle_engine.constants import BattleRuleParam
+from vgc2.battle_engine.game_state import State, SideConditions
+from vgc2.battle_engine.modifiers import Type, Category, Status, Stat, Weather, Terrain, Hazard
+from vgc2.battle_engine.move import Move
+from vgc2.battle_engine.threshold_calculator import paralysis_threshold, thaw_threshold
+
+# columns of BatchBattleEngine.conditions, in the order of SideConditions.__slots__
+SIDE_CONDITIONS = SideConditions.__slots__
+_REFLECT, _LIGHTSCREEN, _TAILWIND, _STEALTH_ROCK, _POISON_SPIKES = 0, 2, 4, 6, 7
+# columns of BatchBattleEngine.field, in the order of State.__slots__ (except sides and hash)
+FIELD = State.__slots__[1:7]
+_WEATHER, _FIELD, _TRICKROOM = 0, 2, 4
+# padding value of BatchBattleEngine.types
+NO_TYPE = len(Type)
+# roll sources
+_ACC, _EFF, _STA = 0, 1, 2
+
+
+class MoveTable:
+    """
+    Static attributes of a list of moves stored as arrays indexed by position in the list.
+    """
+    __slots__ = tuple(f for f in Move.__slots__ if f not in ('id', 'name', '__weakref__'))
+
+    def __init__(self,
+                 moves: list[Move]):
+        for f in self.__slots__:
+            setattr(self, f, np.array([getattr(m, f) for m in moves]))
+
+    def update(self,
+               rows: list[int],
+               moves: list[Move]):
+        # rewrite the given rows from moves, growing the arrays to its length
+        for f in self.__slots__:
+            a = getattr(self, f)
+            if len(a) < len(moves):
+                a = np.concatenate((a, np.zeros((len(moves) - len(a),) + a.shape[1:], dtype=a.dtype)))
+                setattr(self, f, a)
+            if rows:
+                a[rows] = [getattr(moves[i], f) for i in rows]
+
+
+class _RollBuffer:
+    __slots__ = ('rng', 'values', 'cursor')
+
+    def __init__(self,
+                 rng: Generator,
+                 n_battles: int,
+                 n_sources: int,
+                 block: int):
+        self.rng = rng
+        self.values = rng.random((n_battles, n_sources, block))
+        self.cursor = np.zeros((n_battles, n_sources), dtype=np.int64)
+
+    def take(self,
+             b: np.ndarray,
+             source: np.ndarray) -> np.ndarray:
+        c = self.cursor[b, source]
+        exhausted = c >= self.values.shape[2]
+        if exhausted.any():
+            self.values[b[exhausted], source[exhausted]] = self.rng.random((int(exhausted.sum()),
+                                                                              self.values.shape[2]))
+            c[exhausted] = 0
+        self.cursor[b, source] = c + 1
+        return self.values[b, source, c]
+
+
+class BatchBattleEngine:
+    """
+    Struct-of-arrays version of BattleEngine that advances many battles in lockstep. Each phase of a turn is run for
+    all battles at once, one vectorized step per queued action. BattleEngine is the reference implementation, given the
+    same random draws per battle and source (accuracy, effect and status of each side and active position) both produce
+    the same turns. Pokémon are addressed by their slot in active + reserve when the engine was built, the current
+    active and reserve positions are kept in order.
+    """
+
+    _DYNAMIC = ('hp', 'types', 'boosts', 'status', 'wake_turns', 'pp', 'disabled', 'last_move', 'protect',
+                'consecutive_protect', 'order', 'n_active', 'conditions', 'field', 'turn', 'winning_side', 'revealed',
+                'move_rank')
+
+    __slots__ = ('states', 'params', 'turn_limit', 'n_battles', 'max_active', 'moves', 'n_moves', 'n_pkm', 'level',
+                 'stats', 'base_hp', 'move_list', '_members', '_move_table', '_boost_mult', '_acc_mult', '_type_mult',
+                 '_rolls', '_stopped', '_q_valid', '_q_side', '_q_slot', '_q_move', '_q_target', '_switch', '_initial',
+                 '__weakref__') + _DYNAMIC
+
+    def __init__(self,
+                 states: list[State],
+                 params: BattleRuleParam = BattleRuleParam(),
+                 rng: Generator = _RNG,
+                 turn_limit: int = 100,
+                 rng_block: int = 256):
+        self.states = list(states)
+        self.params = params
+        self.turn_limit = turn_limit
+        self.n_battles = n = len(states)
+        teams = [[s.team.active + s.team.reserve for s in state.sides] for state in states]
+        self.max_active = a = max(len(s.team.active) for state in states for s in state.sides)
+        t = max(len(members) for team in teams for members in team)
+        m = max(len(p.battling_moves) for team in teams for members in team for p in members)
+        # static data
+        self.moves = np.zeros((n, 2, t, m), dtype=np.int64)
+        self.n_moves = np.zeros((n, 2, t), dtype=np.int64)
+        self.n_pkm = np.zeros((n, 2), dtype=np.int64)
+        self.level = np.zeros((n, 2, t))
+        self.stats = np.ones((n, 2, t, 6))
+        self.base_hp = np.zeros((n, 2, t))
+        self._members = teams
+        # dynamic data
+        self.hp = np.zeros((n, 2, t))
+        self.types = np.full((n, 2, t, 2), NO_TYPE, dtype=np.int64)
+        self.boosts = np.zeros((n, 2, t, 8), dtype=np.int64)
+        self.status = np.zeros((n, 2, t), dtype=np.int64)
+        self.wake_turns = np.zeros((n, 2, t), dtype=np.int64)
+        self.pp = np.zeros((n, 2, t, m), dtype=np.int64)
+        self.disabled = np.zeros((n, 2, t, m), dtype=bool)
+        self.last_move = np.full((n, 2, t), -1, dtype=np.int64)
+        self.protect = np.zeros((n, 2, t), dtype=bool)
+        self.consecutive_protect = np.zeros((n, 2, t), dtype=np.int64)
+        self.order = np.tile(np.arange(t), (n, 2, 1))
+        self.n_active = np.zeros((n, 2), dtype=np.int64)
+        self.conditions = np.zeros((n, 2, len(SIDE_CONDITIONS)), dtype=np.int64)
+        self.field = np.zeros((n, len(FIELD)), dtype=np.int64)
+        self.turn = np.zeros(n, dtype=np.int64)
+        self.winning_side = np.full(n, -1, dtype=np.int64)
+        # information revealed to the opponent, as tracked by the views
+        self.revealed = np.zeros((n, 2, t), dtype=bool)
+        self.move_rank = np.full((n, 2, t, m), -1, dtype=np.int64)
+        self.move_list = [STRUGGLE.constants]  # moves holds positions in move_list, replaced and never mutated
+        self._move_table = MoveTable(self.move_list)
+        self._boost_mult = np.array([params.BOOST_MULTIPLIER_LOOKUP[i] for i in range(-6, 7)])
+        self._acc_mult = np.array([params.ACCURACY_MULTIPLIER_LOOKUP[i] for i in range(-6, 7)])
+        self._type_mult = np.ones((len(Type), len(Type) + 1))
+        self._type_mult[:, :len(Type)] = [row[:len(Type)] for row in params.DAMAGE_MULTIPLICATION_ARRAY[:len(Type)]]
+        self._rolls = _RollBuffer(rng, n, 3 * 2 * a, rng_block)
+        self._stopped = np.zeros(n, dtype=bool)
+        self._q_valid = np.zeros((n, 2 * a), dtype=bool)
+        self._q_side = np.repeat([0, 1], a)
+        self._q_slot = np.zeros((n, 2 * a), dtype=np.int64)
+        self._q_move = np.zeros((n, 2 * a), dtype=np.int64)
+        self._q_target = np.zeros((n, 2 * a), dtype=np.int64)
+        self._switch = np.zeros((n, 2 * a), dtype=bool)
+        self._initial = {k: getattr(self, k).copy() for k in self._DYNAMIC}
+        self.load(np.arange(n), states)
+
+    def load(self,
+             battles: np.ndarray,
+             states: list[State]):
+        """
+        Replace the battles at the given indexes by new ones built from states, each fitting the engine dimensions. The
+        loaded state is the one restored by reset. Rows of move_list no longer used are recycled.
+        """
+        n_pkm, n_moves = self.moves.shape[2:]
+        keep = np.ones(self.n_battles, dtype=bool)
+        keep[battles] = False
+        live = set(np.unique(self.moves[keep]).tolist()) | {0}
+        move_list = self.move_list[:]
+        move_index = {id(move_list[i]): i for i in live}
+        free = iter(sorted(set(range(len(move_list))) - live))
+        changed = []
+        for b, state in zip(battles, states):
+            teams = [s.team.active + s.team.reserve for s in state.sides]
+            if (max(len(s.team.active) for s in state.sides) > self.max_active or
+                    max(len(members) for members in teams) > n_pkm or
+                    max(len(p.battling_moves) for members in teams for p in members) > n_moves):
+                raise ValueError('State does not fit the engine dimensions.')
+            self.states[b] = state
+            self._members[b] = teams
+            self.moves[b] = 0
+            self.n_moves[b] = 0
+            self.level[b] = 0.
+            self.stats[b] = 1.
+            self.base_hp[b] = 0.
+            self.hp[b] = 0.
+            self.types[b] = NO_TYPE
+            self.boosts[b] = 0
+            self.status[b] = 0
+            self.wake_turns[b] = 0
+            self.pp[b] = 0
+            self.disabled[b] = False
+            self.last_move[b] = -1
+            self.protect[b] = False
+            self.consecutive_protect[b] = 0
+            self.order[b] = np.arange(n_pkm)
+            self.turn[b] = 0
+            self.winning_side[b] = -1
+            self.move_rank[b] = -1
+            for s, side in enumerate(state.sides):
+                self.n_pkm[b, s] = len(teams[s])
+                self.n_active[b, s] = len(side.team.active)
+                self.conditions[b, s] = [getattr(side.conditions, f) for f in SIDE_CONDITIONS]
+                self.revealed[b, s] = np.arange(n_pkm) < len(side.team.active)
+                for slot, pkm in enumerate(teams[s]):
+                    self.level[b, s, slot] = pkm.constants.level
+                    self.stats[b, s, slot] = pkm.constants.stats
+                    self.base_hp[b, s, slot] = pkm.constants.species.base_stats[Stat.MAX_HP]
+                    self.hp[b, s, slot] = pkm.hp
+                    self.types[b, s, slot, :len(pkm.types)] = pkm.types
+                    self.boosts[b, s, slot] = pkm.boosts
+                    self.status[b, s, slot] = pkm.status
+                    self.wake_turns[b, s, slot] = pkm._wake_turns
+                    self.protect[b, s, slot] = pkm.protect
+                    self.consecutive_protect[b, s, slot] = pkm._consecutive_protect
+                    self.n_moves[b, s, slot] = len(pkm.battling_moves)
+                    for i, move in enumerate(pkm.battling_moves):
+                        if id(move.constants) not in move_index:
+                            j = next(free, len(move_list))
+                            if j == len(move_list):
+                                move_list += [move.constants]
+                            else:
+                                move_list[j] = move.constants
+                            move_index[id(move.constants)] = j
+                            changed += [j]
+                        self.moves[b, s, slot, i] = move_index[id(move.constants)]
+                        self.pp[b, s, slot, i] = move.pp
+                        self.disabled[b, s, slot, i] = move.disabled
+                        if move is pkm.last_used_move:
+                            self.last_move[b, s, slot] = i
+            self.field[b] = [getattr(state, f) for f in FIELD]
+            for k in self._DYNAMIC:
+                self._initial[k][b] = getattr(self, k)[b]
+        self.move_list = move_list
+        self._move_table.update(changed, move_list)
+        self._stopped[battles] = False
+
+    def reset(self):
+        for k in self._DYNAMIC:
+            getattr(self, k)[...] = self._initial[k]
+
+    def run_turn(self,
+                 commands: np.ndarray):
+        """
+        commands has shape (n_battles, 2, max_active, 2), with a (action, target) pair per side and active position.
+        Battles already finished are left untouched.
+        """
+        playing = ~self.finished()
+        self.turn[playing] += 1
+        self._stopped[:] = ~playing
+        self._set_action_queue(commands, playing)
+        self._perform_switches(commands)
+        self._perform_moves()
+        self._end_of_turn_state_effects()
+        # battles where a team fainted
+        b = np.flatnonzero(playing & self._stopped)
+        if b.size:
+            team0_fainted, team1_fainted = self._team_fainted(b, 0), self._team_fainted(b, 1)
+            self.winning_side[b[team1_fainted & ~team0_fainted]] = 0
+            self.winning_side[b[team0_fainted & ~team1_fainted]] = 1
+        b = np.flatnonzero(playing & ~self._stopped)
+        limit = self.turn[b] >= self.turn_limit
+        self.winning_side[b[limit]] = (self._tie_breaker(b[limit], 0) > self._tie_breaker(b[limit], 1))
+        self._on_turn_end(b[~limit])
+
+    def terminal(self) -> np.ndarray:
+        b = np.arange(self.n_battles)
+        return self._team_fainted(b, 0) | self._team_fainted(b, 1)
+
+    def finished(self) -> np.ndarray:
+        return self.terminal() | (self.turn >= self.turn_limit)
+
+    def sync_states(self):
+        """
+        Write the current arrays back into the State objects the engine was built from. Views of their teams and
+        Pokémon are notified of the switches and moves revealed so far.
+        """
+        for b, state in enumerate(self.states):
+            for s, side in enumerate(state.sides):
+                members = self._members[b][s]
+                ordered = [members[i] for i in self.order[b, s, :self.n_pkm[b, s]]]
+                side.team.active = ordered[:self.n_active[b, s]]
+                side.team.reserve = ordered[self.n_active[b, s]:]
+                for v in side.team._views:
+                    for i in np.flatnonzero(self.revealed[b, s, :self.n_pkm[b, s]]).tolist():
+                        v.on_switch(members[i])
+                for f, v in zip(SIDE_CONDITIONS, self.conditions[b, s].tolist()):
+                    setattr(side.conditions, f, type(getattr(side.conditions, f))(v))
+                for slot, pkm in enumerate(members):
+                    hp = self.hp[b, s, slot].item()
+                    pkm.hp = int(hp) if hp.is_integer() else hp
+                    pkm.types = [Type(x) for x in self.types[b, s, slot].tolist() if x != NO_TYPE]
+                    pkm.boosts = self.boosts[b, s, slot].tolist()
+                    pkm.status = Status(self.status[b, s, slot])
+                    pkm._wake_turns = int(self.wake_turns[b, s, slot])
+                    pkm.protect = bool(self.protect[b, s, slot])
+                    pkm._consecutive_protect = int(self.consecutive_protect[b, s, slot])
+                    for i, move in enumerate(pkm.battling_moves):
+                        move.pp = int(self.pp[b, s, slot, i])
+                        move.disabled = bool(self.disabled[b, s, slot, i])
+                    last_move = self.last_move[b, s, slot]
+                    pkm.last_used_move = pkm.battling_moves[last_move] if last_move >= 0 else None
+                    rank = self.move_rank[b, s, slot]
+                    if pkm.constants._views and (rank >= 0).any():
+                        for i in np.argsort(np.where(rank >= 0, rank, rank.size), kind='stable')[:(rank >= 0).sum()]:
+                            for v in pkm.constants._views:
+                                v._on_move_used(int(i))
+            state.weather = Weather(self.field[b, _WEATHER])
+            state._weather_turns = int(self.field[b, _WEATHER + 1])
+            state.field = Terrain(self.field[b, _FIELD])
+            state._field_turns = int(self.field[b, _FIELD + 1])
+            state.trickroom = bool(self.field[b, _TRICKROOM])
+            state._trickroom_turns = int(self.field[b, _TRICKROOM + 1])
+            state._hash = None  # recomputed when read
+
+    # queries
+
+    def _team_fainted(self,
+                      b: np.ndarray,
+                      s: np.ndarray | int) -> np.ndarray:
+        present = np.arange(self.hp.shape[2])[None] < self.n_pkm[b, s][:, None]
+        return ~((self.hp[b, s] > 0) & present).any(1)
+
+    def _tie_breaker(self,
+                     b: np.ndarray,
+                     s: int) -> np.ndarray:
+        # summed in team order, as floating point hp are not associative
+        hp = np.take_along_axis(self.hp[b, s], self.order[b, s], 1)
+        total = np.zeros(b.size)
+        for j in range(hp.shape[1]):
+            total += np.where(j < self.n_pkm[b, s], hp[:, j], 0.)
+        return total
+
+    def _active_pos(self,
+                    b: np.ndarray,
+                    s: np.ndarray,
+                    slot: np.ndarray) -> np.ndarray:
+        hit = ((self.order[b, s] == slot[:, None]) &
+               (np.arange(self.order.shape[2])[None] < self.n_active[b, s][:, None]))
+        return np.where(hit.any(1), hit.argmax(1), -1)
+
+    def _first_from_reserve(self,
+                            b: np.ndarray,
+                            s: np.ndarray) -> np.ndarray:
+        j = np.arange(self.order.shape[2])[None]
+        n_active = self.n_active[b, s]
+        alive = ((j >= n_active[:, None]) & (j < self.n_pkm[b, s][:, None]) &
+                 (self.hp[b[:, None], s[:, None], self.order[b, s]] > 0))
+        return np.where(alive.any(1), alive.argmax(1) - n_active, -1)
+
+    def _source(self,
+                kind: int,
+                s: np.ndarray,
+                pos: np.ndarray) -> np.ndarray:
+        return (kind * 2 + s) * self.max_active + pos
+
+    # turn phases
+
+    def _set_action_queue(self,
+                          commands: np.ndarray,
+                          playing: np.ndarray):
+        n, a = self.n_battles, self.max_active
+        action, target = commands[..., 0], commands[..., 1]
+        present = playing[:, None, None] & (np.arange(a)[None, None] < self.n_active[:, :, None])
+        user = self.order[:, :, :a].copy()
+        n_moves = np.take_along_axis(self.n_moves, user, 2)
+        is_move = present & (action >= 0)
+        if (is_move & (n_moves == 0)).any():
+            raise Exception('Invalid Game State: Pokemon with 0 moves.')
+        if (is_move & (action >= n_moves)).any():
+            raise IndexError('Invalid command: move index out of range.')
+        n_def = np.maximum(self.n_active[:, ::-1], 1)[:, :, None]
+        target = np.where(target < n_def, target, 0) % n_def
+        self._q_valid = is_move.reshape(n, 2 * a)
+        self._q_slot = user.reshape(n, 2 * a)
+        self._q_move = np.where(is_move, action, 0).reshape(n, 2 * a)
+        self._q_target = np.take_along_axis(self.order[:, ::-1], target, 2).reshape(n, 2 * a)
+        self._switch = (present & (action < 0)).reshape(n, 2 * a)
+
+    def _perform_switches(self,
+                          commands: np.ndarray):
+        reserve_pos = commands[..., 1].reshape(self.n_battles, -1)
+        for q in reversed(range(2 * self.max_active)):
+            b = np.flatnonzero(self._switch[:, q] & ~self._stopped)
+            if b.size:
+                s, pos = divmod(q, self.max_active)
+                self._switch_pkm(b, np.full(b.size, s), np.full(b.size, pos), reserve_pos[b, q])
+
+    def _perform_moves(self):
+        while True:
+            b = np.flatnonzero(self._q_valid.any(1) & ~self._stopped)
+            if not b.size:
+                return
+            # determine next move
+            q = self._priority(b).argmax(1)
+            self._q_valid[b, q] = False
+            s, slot = self._q_side[q], self._q_slot[b, q]
+            self._perform_move(b, s, slot, self._q_move[b, q], self._q_target[b, q])
+
+    def _priority(self,
+                  b: np.ndarray) -> np.ndarray:
+        s, slot = self._q_side[None], self._q_slot[b]
+        mv = self.moves[b[:, None], s, slot, self._q_move[b]]
+        speed = (self._boost_mult[self.boosts[b[:, None], s, slot, Stat.SPEED] + 6] *
+                 self.stats[b[:, None], s, slot, Stat.SPEED])
+        paralysis = np.where(self.status[b[:, None], s, slot] == Status.PARALYZED, self.params.PARALYSIS_MODIFIER, 1.)
+        trickroom = np.where(self.field[b, _TRICKROOM] > 0, self.params.TRICKROOM_MODIFIER, 1.)[:, None]
+        priority = self._move_table.priority[mv] * 1000 + paralysis * trickroom * speed
+        return np.where(self._q_valid[b], priority, -np.inf)
+
+    def _perform_move(self,
+                      b: np.ndarray,
+                      s: np.ndarray,
+                      slot: np.ndarray,
+                      m: np.ndarray,
+                      target: np.ndarray):
+        mt = self._move_table
+        # before each move check if Pokémon can attack due status or have its status removed
+        pos = self._active_pos(b, s, slot)
+        go = ~self._perform_status(b, s, pos, slot, self.moves[b, s, slot, m])
+        b, s, slot, m, target, pos = b[go], s[go], slot[go], m[go], target[go], pos[go]
+        valid = np.arange(self.pp.shape[3])[None] < self.n_moves[b, s, slot][:, None]
+        pp, disabled = self.pp[b, s, slot], self.disabled[b, s, slot]
+        usable = valid & (pp > 0) & ~disabled
+        k = np.arange(b.size)
+        replace = disabled[k, m] | (pp[k, m] == 0)
+        struggle = ~(valid & (pp > 0)).any(1) | (replace & ~usable.any(1))
+        m = np.where(replace & ~struggle, usable.argmax(1), m)
+        mv = np.where(struggle, 0, self.moves[b, s, slot, m])
+        u = ~struggle
+        self.pp[b[u], s[u], slot[u], m[u]] = np.maximum(0, pp[k[u], m[u]] - 1)
+        # a move is revealed the first time it is used, ranked by order of use
+        rank = self.move_rank[b[u], s[u], slot[u]]
+        i = np.flatnonzero(rank[np.arange(rank.shape[0]), m[u]] < 0)
+        self.move_rank[b[u][i], s[u][i], slot[u][i], m[u][i]] = (rank[i] >= 0).sum(1)
+        # a protected defender is not hit, damage is applied first and then effects
+        ds = 1 - s
+        hit = ~self.protect[b, ds, target]
+        i = np.flatnonzero(hit)
+        hit[i] = (self._rolls.take(b[i], self._source(_ACC, s[i], pos[i])) <
+                  self._hit_threshold(b[i], s[i], slot[i], mv[i], ds[i], target[i]))
+        damage = np.zeros(b.size)
+        i = np.flatnonzero(hit)
+        damage[i] = self._damage(b[i], s[i], slot[i], mv[i], ds[i], target[i])
+        self._deal_damage(b[i], ds[i], target[i], damage[i])
+        i = np.flatnonzero(hit & ~self._stopped[b] & (self.hp[b, ds, target] > 0))
+        effect = self._rolls.take(b[i], self._source(_EFF, s[i], pos[i])) < mt.effect_prob[mv[i]]
+        i = i[effect]
+        self._perform_target_effects(b[i], s[i], mv[i], ds[i], target[i])
+        # a fire move will thaw a frozen target
+        i = np.flatnonzero(hit & ~self._stopped[b] & (self.hp[b, ds, target] > 0) &
+                           (mt.pkm_type[mv] == Type.FIRE) & (damage > 0) &
+                           (self.status[b, ds, target] == Status.FROZEN))
+        self.status[b[i], ds[i], target[i]] = Status.NONE
+        i = np.flatnonzero(hit & ~self._stopped[b])
+        effect = self._rolls.take(b[i], self._source(_EFF, s[i], pos[i])) < mt.effect_prob[mv[i]]
+        i = i[effect]
+        self._perform_single_effects(b[i], s[i], slot[i], mv[i], damage[i])
+
+    def _perform_status(self,
+                        b: np.ndarray,
+                        s: np.ndarray,
+                        pos: np.ndarray,
+                        slot: np.ndarray,
+                        mv: np.ndarray) -> np.ndarray:
+        status = self.status[b, s, slot]
+        skip = np.zeros(b.size, dtype=bool)
+        i = np.flatnonzero(status == Status.PARALYZED)
+        skip[i] = self._rolls.take(b[i], self._source(_STA, s[i], pos[i])) < paralysis_threshold(self.params)
+        asleep = status == Status.SLEEP
+        wake = asleep & (self.wake_turns[b, s, slot] == 0)
+        skip |= asleep & ~wake
+        frozen = status == Status.FROZEN
+        thaw = frozen & (self._move_table.pkm_type[mv] == Type.FIRE)
+        i = np.flatnonzero(frozen & ~thaw)
+        thaw[i] = self._rolls.take(b[i], self._source(_STA, s[i], pos[i])) < thaw_threshold(self.params)
+        skip |= frozen & ~thaw
+        i = np.flatnonzero(wake | thaw)
+        self.status[b[i], s[i], slot[i]] = Status.NONE
+        return skip
+
+    def _hit_threshold(self,
+                       b: np.ndarray,
+                       s: np.ndarray,
+                       slot: np.ndarray,
+                       mv: np.ndarray,
+                       ds: np.ndarray,
+                       target: np.ndarray) -> np.ndarray:
+        mt = self._move_table
+        accuracy = self.boosts[b, s, slot, Stat.ACCURACY] - np.where(mt.ignore_evasion[mv], 0,
+                                                                       self.boosts[b, ds, target, Stat.EVASION])
+        protect = np.where(mt.protect[mv], self.params.PROTECT_MODIFIER ** self.consecutive_protect[b, s, slot], 1.)
+        return mt.accuracy[mv] * self._acc_mult[np.clip(accuracy, -6, 6) + 6] * protect
+
+    def _type_effectiveness(self,
+                            move_type: np.ndarray,
+                            types: np.ndarray) -> np.ndarray:
+        return np.where(move_type == Type.TYPELESS, 1.,
+                        1. * self._type_mult[move_type, types[:, 0]] * self._type_mult[move_type, types[:, 1]])
+
+    def _damage(self,
+                b: np.ndarray,
+                s: np.ndarray,
+                slot: np.ndarray,
+                mv: np.ndarray,
+                ds: np.ndarray,
+                target: np.ndarray) -> np.ndarray:
+        params, mt = self.params, self._move_table
+        category, power, move_type = mt.category[mv], mt.base_power[mv], mt.pkm_type[mv]
+        physical = category == Category.PHYSICAL
+        attack = np.where(physical, Stat.ATTACK, Stat.SPECIAL_ATTACK)
+        defense = np.where(physical, Stat.DEFENSE, Stat.SPECIAL_DEFENSE)
+        attacking = self._boost_mult[self.boosts[b, s, slot, attack] + 6] * self.stats[b, s, slot, attack]
+        defending = self._boost_mult[self.boosts[b, ds, target, defense] + 6] * self.stats[b, ds, target, defense]
+        # rock types get 1.5x SPDEF in sand, ice types get 1.5x DEF in snow
+        weather = self.field[b, _WEATHER]
+        types = self.types[b, ds, target]
+        weather_boost = (((weather == Weather.SAND) & (types == Type.ROCK).any(1) & ~physical) |
+                         ((weather == Weather.SNOW) & (types == Type.ICE).any(1) & physical))
+        defending = np.where(weather_boost, np.trunc(defending * params.WEATHER_BOOST), defending)
+        # apply damage formula
+        damage = np.trunc(np.trunc((2 * self.level[b, s, slot]) / 5) + 2) * power
+        damage = np.trunc(damage * attacking / defending)
+        damage = np.trunc(damage / 50) + 2
+        # modifiers
+        attacker_types = self.types[b, s, slot]
+        status = self.status[b, s, slot]
+        field = self.field[b, _FIELD]
+        conditions = self.conditions[b, s]
+        special = category == Category.SPECIAL
+        fire, water = move_type == Type.FIRE, move_type == Type.WATER
+        sun, rain = weather == Weather.SUN, weather == Weather.RAIN
+        modifier = 1
+        modifier *= self._type_effectiveness(move_type, types)
+        modifier *= np.where((sun & fire) | (rain & water), params.WEATHER_BOOST,
+                             np.where((sun & water) | (rain & fire), params.WEATHER_UNBOOST, 1))
+        modifier *= np.where((move_type != Type.TYPELESS) & (attacker_types == move_type[:, None]).any(1),
+                             params.STAB_MODIFIER, 1)
+        modifier *= np.where((status == Status.BURN) & physical, params.BURN_DAMAGE_MODIFIER, 1)
+        modifier *= np.where(((field == Terrain.ELECTRIC_TERRAIN) & (move_type == Type.ELECTRIC)) |
+                             ((field == Terrain.GRASSY_TERRAIN) & (move_type == Type.GRASS)) |
+                             ((field == Terrain.PSYCHIC_TERRAIN) & (move_type == Type.PSYCHIC)),
+                             params.TERRAIN_DAMAGE_BOOST,
+                             np.where((field == Terrain.MISTY_TERRAIN) & (move_type == Type.DRAGON),
+                                      params.TERRAIN_DAMAGE_UNBOOST,
+                                      np.where((field == Terrain.PSYCHIC_TERRAIN) & (mt.priority[mv] > 0), 0, 1)))
+        modifier *= np.where((conditions[:, _LIGHTSCREEN] > 0) & special, params.LIGHT_SCREEN_MODIFIER, 1)
+        modifier *= np.where((conditions[:, _REFLECT] > 0) & physical, params.REFLECT_MODIFIER, 1)
+        return np.where((physical | special) & (power > 0), np.trunc(damage * modifier), 0.)
+
+    def _perform_single_effects(self,
+                                b: np.ndarray,
+                                s: np.ndarray,
+                                slot: np.ndarray,
+                                mv: np.ndarray,
+                                damage: np.ndarray):
+        mt = self._move_table
+        field, conditions = self.field[b], self.conditions[b, s]
+        # only the first effect that applies takes place
+        chain = np.stack([
+            (mt.weather_start[mv] != Weather.CLEAR) & (mt.weather_start[mv] != field[:, _WEATHER]),
+            (mt.field_start[mv] != Terrain.NONE) & (mt.field_start[mv] != field[:, _FIELD]),
+            mt.toggle_trickroom[mv] & (field[:, _TRICKROOM] == 0),
+            mt.toggle_lightscreen[mv] & (conditions[:, _LIGHTSCREEN] == 0),
+            mt.toggle_reflect[mv] & (conditions[:, _REFLECT] == 0),
+            mt.toggle_tailwind[mv] & (conditions[:, _TAILWIND] == 0),
+            mt.hazard[mv] == Hazard.STEALTH_ROCK,
+            mt.hazard[mv] == Hazard.TOXIC_SPIKES,
+            mt.heal[mv] > 0,
+            mt.recoil[mv] > 0,
+            mt.self_switch[mv],
+            mt.change_type[mv],
+            mt.self_boosts[mv] & (mt.boosts[mv] != 0).any(1),
+            mt.protect[mv]], 1)
+        effect = np.where(chain.any(1), chain.argmax(1), -1)
+        # State changes
+        i = effect == 0
+        self.field[b[i], _WEATHER] = mt.weather_start[mv[i]]
+        i = effect == 1
+        self.field[b[i], _FIELD] = mt.field_start[mv[i]]
+        i = effect == 2
+        self.field[b[i], _TRICKROOM] = 1
+        # Side conditions changes
+        for e, c in ((3, _LIGHTSCREEN), (4, _REFLECT), (5, _TAILWIND), (6, _STEALTH_ROCK), (7, _POISON_SPIKES)):
+            i = effect == e
+            self.conditions[b[i], s[i], c] = 1
+        # Pokémon effects
+        i = effect == 8
+        self.hp[b[i], s[i], slot[i]] = np.minimum(self.hp[b[i], s[i], slot[i]] + np.trunc(damage[i] * mt.heal[mv[i]]),
+                                                  self.base_hp[b[i], s[i], slot[i]])
+        i = effect == 11
+        self.types[b[i], s[i], slot[i]] = NO_TYPE
+        self.types[b[i], s[i], slot[i], 0] = mt.pkm_type[self.moves[b[i], s[i], slot[i], 0]]
+        i = effect == 12
+        self.boosts[b[i], s[i], slot[i]] = np.clip(self.boosts[b[i], s[i], slot[i]] + mt.boosts[mv[i]], -6, 6)
+        i = effect == 13
+        self.protect[b[i], s[i], slot[i]] = True
+        i = effect == 9
+        self._deal_damage(b[i], s[i], slot[i], np.trunc(damage[i] * mt.recoil[mv[i]]))
+        i = effect == 10
+        self._switch_pkm(b[i], s[i], self._active_pos(b[i], s[i], slot[i]), self._first_from_reserve(b[i], s[i]))
+
+    def _perform_target_effects(self,
+                                b: np.ndarray,
+                                s: np.ndarray,
+                                mv: np.ndarray,
+                                ds: np.ndarray,
+                                target: np.ndarray):
+        mt = self._move_table
+        last_move = self.last_move[b, ds, target]
+        # only the first effect that applies takes place
+        chain = np.stack([
+            (mt.status[mv] != Status.NONE) & (self.status[b, ds, target] == Status.NONE),
+            mt.disable[mv] & ~self.disabled[b, ds, target].any(1) & (last_move >= 0),
+            mt.force_switch[mv],
+            ~mt.self_boosts[mv] & (mt.boosts[mv] != 0).any(1)], 1)
+        effect = np.where(chain.any(1), chain.argmax(1), -1)
+        # Pokémon effects
+        i = effect == 0
+        self.status[b[i], ds[i], target[i]] = mt.status[mv[i]]
+        # Move Effects
+        i = effect == 1
+        self.disabled[b[i], ds[i], target[i], last_move[i]] = True
+        i = effect == 3
+        self.boosts[b[i], ds[i], target[i]] = np.clip(self.boosts[b[i], ds[i], target[i]] + mt.boosts[mv[i]], -6, 6)
+        i = effect == 2
+        self._switch_pkm(b[i], ds[i], self._active_pos(b[i], ds[i], target[i]), self._first_from_reserve(b[i], ds[i]))
+
+    def _end_of_turn_state_effects(self):
+        b = np.flatnonzero(~self._stopped)
+        a = self.max_active
+        # Pokémon active at the start of this phase, even if they switch out meanwhile
+        active = self.order[b, :, :a].copy()
+        n_active = self.n_active[b].copy()
+        weather = self.field[b, _WEATHER]
+        for status, modifier in ((Status.POISON, self.params.POISON_MODIFIER),
+                                 (Status.BURN, self.params.BURN_MODIFIER),
+                                 (None, self.params.SAND_MODIFIER)):
+            for s in (0, 1):
+                for pos in range(a):
+                    slot = active[:, s, pos]
+                    if status is None:
+                        immune = np.isin(self.types[b, s, slot], (Type.ROCK, Type.GROUND, Type.STEEL)).any(1)
+                        damage = np.where(immune, 0, self.base_hp[b, s, slot] * modifier)
+                        i = np.flatnonzero((pos < n_active[:, s]) & (weather == Weather.SAND) & ~self._stopped[b])
+                    else:
+                        damage = self.base_hp[b, s, slot] * modifier
+                        i = np.flatnonzero((pos < n_active[:, s]) & (self.status[b, s, slot] == status) &
+                                           ~self._stopped[b])
+                    self._deal_damage(b[i], np.full(i.size, s), slot[i], damage[i])
+
+    def _on_turn_end(self,
+                     b: np.ndarray):
+        params = self.params
+        field = self.field[b]
+        for c, limit in ((_WEATHER, params.WEATHER_TURNS), (_FIELD, params.TERRAIN_TURNS),
+                         (_TRICKROOM, params.TRICKROOM_TURNS)):
+            on = field[:, c] != 0
+            field[on, c + 1] += 1
+            end = on & (field[:, c + 1] >= limit)
+            field[end, c] = 0
+            field[end, c + 1] = 0
+        self.field[b] = field
+        conditions = self.conditions[b]
+        for c, limit in ((_REFLECT, params.REFLECT_TURNS), (_LIGHTSCREEN, params.LIGHTSCREEN_TURNS),
+                         (_TAILWIND, params.TAILWIND_TURNS)):
+            on = conditions[:, :, c] != 0
+            conditions[:, :, c + 1] += on
+            end = on & (conditions[:, :, c + 1] >= limit)
+            conditions[:, :, c][end] = 0
+            conditions[:, :, c + 1][end] = 0
+        self.conditions[b] = conditions
+        for s in (0, 1):
+            for pos in range(self.max_active):
+                i = b[pos < self.n_active[b, s]]
+                slot = self.order[i, s, pos]
+                protect = self.protect[i, s, slot]
+                self.consecutive_protect[i, s, slot] = np.where(protect, self.consecutive_protect[i, s, slot] + 1, 0)
+                self.protect[i, s, slot] = False
+                asleep = self.status[i, s, slot] == Status.SLEEP
+                self.wake_turns[i[asleep], s, slot[asleep]] -= 1
+
+    # Pokémon events
+
+    def _deal_damage(self,
+                     b: np.ndarray,
+                     s: np.ndarray,
+                     slot: np.ndarray,
+                     damage: np.ndarray):
+        hp = np.maximum(0, self.hp[b, s, slot] - damage)
+        self.hp[b, s, slot] = hp
+        fainted = hp == 0
+        if fainted.any():
+            self._on_fainted(b[fainted], s[fainted], slot[fainted])
+
+    def _on_fainted(self,
+                    b: np.ndarray,
+                    s: np.ndarray,
+                    slot: np.ndarray):
+        team_fainted = self._team_fainted(b, s)
+        self._stopped[b[team_fainted]] = True
+        b, s, slot = b[~team_fainted], s[~team_fainted], slot[~team_fainted]
+        self._switch_pkm(b, s, self._active_pos(b, s, slot), self._first_from_reserve(b, s))
+
+    def _switch_pkm(self,
+                    b: np.ndarray,
+                    s: np.ndarray,
+                    active_pos: np.ndarray,
+                    reserve_pos: np.ndarray):
+        i = (active_pos >= 0) & (active_pos < self.n_active[b, s])
+        b, s, active_pos, reserve_pos = b[i], s[i], active_pos[i], reserve_pos[i]
+        if not b.size:
+            return
+        old_active = self.order[b, s, active_pos]
+        n_active, n_pkm = self.n_active[b, s], self.n_pkm[b, s]
+        j = np.arange(self.order.shape[2])[None]
+        in_reserve = (j >= n_active[:, None]) & (j < n_pkm[:, None])
+        reserve_alive = (in_reserve & (self.hp[b[:, None], s[:, None], self.order[b, s]] > 0)).any(1)
+        # active fainted and reserve fainted, the active is moved to the end of the reserve
+        i = ~reserve_alive & (self.hp[b, s, old_active] == 0)
+        if i.any():
+            self._retire(b[i], s[i], active_pos[i], old_active[i])
+        i = ~i & (reserve_pos >= 0) & (reserve_pos < n_pkm - n_active)
+        b, s, active_pos, old_active = b[i], s[i], active_pos[i], old_active[i]
+        reserve_pos = n_active[i] + reserve_pos[i]
+        old_reserve = self.order[b, s, reserve_pos]
+        i = self.hp[b, s, old_reserve] > 0
+        b, s, active_pos, old_active, reserve_pos, old_reserve = (b[i], s[i], active_pos[i], old_active[i],
+                                                                  reserve_pos[i], old_reserve[i])
+        self.boosts[b, s, old_active] = 0
+        self.disabled[b, s, old_active] = False
+        self.last_move[b, s, old_active] = -1
+        self.protect[b, s, old_active] = False
+        self.order[b, s, reserve_pos] = old_active
+        self.order[b, s, active_pos] = old_reserve
+        self.revealed[b, s, old_reserve] = True
+        self._on_switch(b, s, old_reserve, old_active)
+
+    def _retire(self,
+                b: np.ndarray,
+                s: np.ndarray,
+                active_pos: np.ndarray,
+                old_active: np.ndarray):
+        j = np.arange(self.order.shape[2])[None]
+        pos, last = active_pos[:, None], self.n_pkm[b, s][:, None] - 1
+        src = np.where(j < pos, j, np.where(j < last, j + 1, np.where(j == last, pos, j)))
+        self.order[b, s] = np.take_along_axis(self.order[b, s], src, 1)
+        self.n_active[b, s] -= 1
+        self._on_switch(b, s, None, old_active)
+
+    def _on_switch(self,
+                   b: np.ndarray,
+                   s: np.ndarray,
+                   switch_in: np.ndarray | None,
+                   switch_out: np.ndarray):
+        # if a Pokémon switches out it will no longer perform its moves
+        self._q_valid[b] &= ~((self._q_side[None] == s[:, None]) & (self._q_slot[b] == switch_out[:, None]))
+        # hazards
+        if switch_in is None:
+            return
+        conditions = self.conditions[b, s]
+        types = self.types[b, s, switch_in]
+        i = ((conditions[:, _POISON_SPIKES] > 0) & ~(types == Type.POISON).any(1) & ~(types == Type.STEEL).any(1) &
+             (self.status[b, s, switch_in] == Status.NONE))
+        self.status[b[i], s[i], switch_in[i]] = Status.POISON
+        i = conditions[:, _STEALTH_ROCK] > 0
+        if i.any():
+            b, s, switch_in, types = b[i], s[i], switch_in[i], types[i]
+            damage = (self.base_hp[b, s, switch_in] * self.params.STEALTH_ROCK_MODIFIER *
+                      self._type_effectiveness(np.full(b.size, Type.ROCK), types))
+            self._deal_damage(b, s, switch_in, damage)
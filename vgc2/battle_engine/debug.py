@@ -0,0 +1,40 @@
+from time import perf_counter
+from typing import Callable
+
+
+class DebugInfo:
+    """
+    Opt-in BattleEngine instrumentation. Accumulates wall time per turn phase and a counter per event, each event is
+    also passed to callback, if any, with its name and arguments.
+    """
+    __slots__ = ('phase_time', 'counters', 'callback')
+
+    def __init__(self,
+                 callback: Callable[..., None] | None = None):
+        self.phase_time: dict[str, float] = {}
+        self.counters: dict[str, int] = {}
+        self.callback = callback
+
+    def __str__(self):
+        return ("Phase time " + str({k: round(v, 6) for k, v in self.phase_time.items()}) +
+                ", Counters " + str(self.counters))
+
+    def time(self,
+             phase: str,
+             f: Callable[[], None]):
+        start = perf_counter()
+        try:
+            f()
+        finally:
+            self.phase_time[phase] = self.phase_time.get(phase, 0.) + perf_counter() - start
+
+    def event(self,
+              name: str,
+              *args):
+        self.counters[name] = self.counters.get(name, 0) + 1
+        if self.callback is not None:
+            self.callback(name, *args)
+
+    def reset(self):
+        self.phase_time = {}
+        self.counters = {}
@@ -0,0 +1,110 @@
+from enum import IntEnum
+from typing import BinaryIO
+
+from numpy import dtype, array, fromfile, ndarray
+
+MAGIC = b'VGCLOG\x01\x00'
+
+
+class BattleEvent(IntEnum):
+    TURN = 0
+    MOVE = 1
+    DAMAGE = 2
+    RECOVER = 3
+    SWITCH = 4
+    FAINT = 5
+    STATUS = 6
+    WEATHER = 7
+    FIELD = 8
+
+
+# Pokémon and moves are referred by their species and move ids, as labeled by label_teams
+EVENT_DTYPE = dtype([('turn', '<u2'),
+                     ('event', 'u1'),
+                     ('side', 'u1'),
+                     ('pkm', '<i2'),  # species id of the Pokémon acting or affected
+                     ('arg', '<i2'),  # move id, hp after damage or heal, switched out id, status, weather or field
+                     ('value', '<f4')])  # damage or heal
+
+
+class BattleLog:
+    """
+    Append-only binary battle event log. Used as a DebugInfo callback it records the events of every battle ran by the
+    engine, a new battle starts at each turn 1. Events are buffered and written to file every buffer_size records, after
+    a MAGIC header, as EVENT_DTYPE records.
+    """
+    __slots__ = ('file', 'buffer_size', 'records', 'turn', '_own_file')
+
+    def __init__(self,
+                 file: str | BinaryIO,
+                 buffer_size: int = 4096):
+        self._own_file = isinstance(file, str)
+        self.file = open(file, 'wb') if self._own_file else file
+        self.file.write(MAGIC)
+        self.buffer_size = buffer_size
+        self.records: list[tuple[int, int, int, int, int, float]] = []
+        self.turn = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __call__(self,
+                 name: str,
+                 *args):
+        match name:
+            case 'turn':
+                self.turn = args[0]
+                self.append(BattleEvent.TURN, 0, -1, -1, 0.)
+            case 'move':
+                side, pkm, move = args
+                self.append(BattleEvent.MOVE, side, pkm.constants.species.id, move.constants.id, 0.)
+            case 'deal_damage':
+                side, pkm, damage = args
+                self.append(BattleEvent.DAMAGE, side, pkm.constants.species.id, max(0, pkm.hp - damage), damage)
+            case 'recover':
+                side, pkm, heal = args
+                self.append(BattleEvent.RECOVER, side, pkm.constants.species.id, pkm.hp, heal)
+            case 'switch':
+                side, switch_in, switch_out = args
+                self.append(BattleEvent.SWITCH, side, switch_in.constants.species.id if switch_in else -1,
+                            switch_out.constants.species.id, 0.)
+            case 'faint':
+                side, pkm = args
+                self.append(BattleEvent.FAINT, side, pkm.constants.species.id, 0, 0.)
+            case 'status':
+                side, pkm, status = args
+                self.append(BattleEvent.STATUS, side, pkm.constants.species.id, status, 0.)
+            case 'weather':
+                self.append(BattleEvent.WEATHER, 0, -1, args[0], 0.)
+            case 'field':
+                self.append(BattleEvent.FIELD, 0, -1, args[0], 0.)
+
+    def append(self,
+               event: BattleEvent,
+               side: int,
+               pkm: int,
+               arg: int,
+               value: float):
+        self.records += [(self.turn, event, side, pkm, arg, value)]
+        if len(self.records) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.file.write(array(self.records, dtype=EVENT_DTYPE).tobytes())
+        self.file.flush()
+        self.records = []
+
+    def close(self):
+        self.flush()
+        if self._own_file:
+            self.file.close()
+
+
+def read_battle_log(path: str) -> ndarray:
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not a battle log: ' + path)
+        return fromfile(f, dtype=EVENT_DTYPE)
@@ -1,7 +1,11 @@
+from numpy import ndarray, zeros
+
 from vgc2.battle_engine import BattleRuleParam
 from vgc2.battle_engine.modifiers import Weather, Terrain
+from vgc2.battle_engine.observers import Observers
 from vgc2.battle_engine.pokemon import BattlingPokemon
 from vgc2.battle_engine.team import BattlingTeam, Team
+from vgc2.battle_engine.zobrist import state_hash
 
 
 class SideConditions:
@@ -53,9 +57,33 @@ class SideConditions:
                 self.tailwind = False
                 self._tailwind_turns = 0
 
+    def _pack(self,
+              out: memoryview,
+              i: int):
+        out[i] = self.reflect
+        out[i + 1] = self._reflect_turns
+        out[i + 2] = self.lightscreen
+        out[i + 3] = self._lightscreen_turns
+        out[i + 4] = self.tailwind
+        out[i + 5] = self._tailwind_turns
+        out[i + 6] = self.stealth_rock
+        out[i + 7] = self.poison_spikes
+
+    def _unpack(self,
+                values: list,
+                i: int):
+        self.reflect = bool(values[i])
+        self._reflect_turns = int(values[i + 1])
+        self.lightscreen = bool(values[i + 2])
+        self._lightscreen_turns = int(values[i + 3])
+        self.tailwind = bool(values[i + 4])
+        self._tailwind_turns = int(values[i + 5])
+        self.stealth_rock = bool(values[i + 6])
+        self.poison_spikes = bool(values[i + 7])
+
 
 class Side:
-    __slots__ = ('team', 'conditions', '_engine', '_views')
+    __slots__ = ('team', 'conditions', '_engine', '_views', '__weakref__')
 
     def __init__(self,
                  team: BattlingTeam,
@@ -63,7 +91,7 @@ class Side:
         self.team = team
         self.conditions = conditions if conditions else SideConditions()
         self._engine = None
-        self._views = []
+        self._views = Observers()
 
     def __str__(self):
         return str(self.team) + str(self.conditions)
@@ -91,7 +119,15 @@ def get_battle_teams(team: tuple[Team, Team],
 
 
 class State:
-    __slots__ = ('sides', 'weather', '_weather_turns', 'field', '_field_turns', 'trickroom', '_trickroom_turns')
+    """
+    Battle state. hash is a 64-bit Zobrist hash of the position (hp buckets, boosts, status, pp, protection, disabled
+    moves, team order, weather, terrain, trick room and side conditions), turn counters are left out. It is computed
+    when first read after a change, or updated incrementally by the BattleEngine the State is bound to once
+    BattleEngine.track_hash is called. Changes made outside an engine must be followed by rehash. Hashes are only
+    comparable within a process.
+    """
+    __slots__ = ('sides', 'weather', '_weather_turns', 'field', '_field_turns', 'trickroom', '_trickroom_turns',
+                 '_hash', '_layout')
 
     def __init__(self,
                  team_side: tuple[BattlingTeam, BattlingTeam] | tuple[Side, Side]):
@@ -102,6 +138,8 @@ class State:
         self._field_turns = 0
         self.trickroom = False
         self._trickroom_turns = 0
+        self._hash: int | None = None
+        self._layout: tuple | None = None
 
     def __str__(self):
         return (("Weather " + self.weather.name + ", " if self.weather != Weather.CLEAR else "") +
@@ -118,6 +156,19 @@ class State:
         self._field_turns = 0
         self.trickroom = False
         self._trickroom_turns = 0
+        self._hash = None
+
+    @property
+    def hash(self) -> int:
+        if self._hash is None:
+            self._hash = state_hash(self)
+        return self._hash
+
+    def rehash(self):
+        """
+        Recompute hash from the whole state.
+        """
+        self._hash = state_hash(self)
 
     def _on_turn_end(self,
                      params: BattleRuleParam):
@@ -142,9 +193,79 @@ class State:
         for side in self.sides:
             side._on_turn_end(params)
 
+    def _get_layout(self) -> tuple:
+        # team, members in their initial order and the offset of each side and member, kept until a team is replaced
+        layout = self._layout
+        if layout is None or layout[0][0] is not self.sides[0].team or layout[1][0] is not self.sides[1].team:
+            sides = []
+            i = 6
+            for side in self.sides:
+                team = side.team
+                members = team._initial_active + team._initial_reserve
+                offsets = []
+                j = i + 9 + len(members)
+                for pkm in members:
+                    offsets += [j]
+                    j += 16 + 2 * len(pkm.battling_moves)
+                sides += [(team, members, {id(pkm): k for k, pkm in enumerate(members)}, i, tuple(offsets))]
+                i = j
+            layout = self._layout = sides[0], sides[1], i
+        return layout
+
+    def to_buffer(self,
+                  out: ndarray | None = None) -> ndarray:
+        """
+        Pack the dynamic battle state into a flat array, static data is left out. out may be a preallocated buffer of
+        buffer_len() size. The buffer can be restored only into this State.
+        """
+        layout = self._get_layout()
+        if out is None:
+            out = zeros(layout[2])
+        view = memoryview(out)
+        view[0] = self.weather
+        view[1] = self._weather_turns
+        view[2] = self.field
+        view[3] = self._field_turns
+        view[4] = self.trickroom
+        view[5] = self._trickroom_turns
+        for side, (team, members, slots, i, offsets) in zip(self.sides, layout):
+            side.conditions._pack(view, i)
+            team._pack(view, i + 8, slots)
+            for pkm, j in zip(members, offsets):
+                pkm._pack(view, j)
+        return out
+
+    def from_buffer(self,
+                    buffer: ndarray):
+        """
+        Restore in place a dynamic battle state packed by to_buffer. Only changed values are assigned.
+        """
+        values = buffer.tolist()
+        if values[0] != self.weather:
+            self.weather = Weather(int(values[0]))
+        self._weather_turns = int(values[1])
+        if values[2] != self.field:
+            self.field = Terrain(int(values[2]))
+        self._field_turns = int(values[3])
+        self.trickroom = bool(values[4])
+        self._trickroom_turns = int(values[5])
+        for side, (team, members, slots, i, offsets) in zip(self.sides, self._get_layout()):
+            side.conditions._unpack(values, i)
+            team._unpack(values, i + 8, members)
+            for pkm, j in zip(members, offsets):
+                pkm._unpack(values, j)
+        self._hash = None
+
+    def buffer_len(self) -> int:
+        return self._get_layout()[2]
+
     def terminal(self) -> bool:
         return any(s.team.fainted() for s in self.sides)
 
     def get_side(self,
                  pkm: BattlingPokemon) -> int:
+        if pkm._team is self.sides[0].team:
+            return 0
+        if pkm._team is self.sides[1].team:
+            return 1
         return 0 if pkm in self.sides[0].team.active or pkm in self.sides[0].team.reserve else 1
@@ -0,0 +1,37 @@
+class Journal:
+    """
+    Reversible log of mutations. Each entry holds an object, one of its attributes and the value it had before being
+    changed, undoing restores them in reverse order.
+    """
+    __slots__ = ('entries',)
+
+    def __init__(self):
+        self.entries: list[tuple[object, str, object]] = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def record(self,
+               obj: object,
+               *attrs: str):
+        for attr in attrs:
+            self.entries += [(obj, attr, getattr(obj, attr))]
+
+    def record_copy(self,
+                    obj: object,
+                    attr: str):
+        # for lists that are mutated in place
+        self.entries += [(obj, attr, getattr(obj, attr)[:])]
+
+    def mark(self) -> int:
+        return len(self.entries)
+
+    def undo(self,
+             mark: int = 0):
+        entries = self.entries
+        while len(entries) > mark:
+            obj, attr, value = entries.pop()
+            setattr(obj, attr, value)
+
+    def clear(self):
+        self.entries = []
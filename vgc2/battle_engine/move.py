@@ -5,7 +5,7 @@ class Move:
     __slots__ = ('id', 'pkm_type', 'base_power', 'accuracy', 'max_pp', 'category', 'priority', 'effect_prob',
                  'force_switch', 'self_switch', 'ignore_evasion', 'protect', 'boosts', 'self_boosts', 'heal', 'recoil',
                  'weather_start', 'field_start', 'toggle_trickroom', 'change_type', 'toggle_reflect',
-                 'toggle_lightscreen', 'toggle_tailwind', 'hazard', 'status', 'disable', 'name')
+                 'toggle_lightscreen', 'toggle_tailwind', 'hazard', 'status', 'disable', 'name', '__weakref__')
 
     def __init__(self,
                  pkm_type: Type,
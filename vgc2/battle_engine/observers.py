@@ -0,0 +1,11 @@
+from weakref import WeakSet
+
+
+class Observers(WeakSet):
+    """
+    Weakly referenced observers, such as views, dropped as soon as they are no longer used elsewhere. Observers are not
+    kept when pickled.
+    """
+
+    def __reduce__(self):
+        return self.__class__, ()
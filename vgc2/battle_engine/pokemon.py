@@ -3,6 +3,7 @@ import math
 from vgc2.battle_engine.constants import NATURES
 from vgc2.battle_engine.modifiers import Type, Stat, Status, Stats, Nature
 from vgc2.battle_engine.move import Move, BattlingMove
+from vgc2.battle_engine.observers import Observers
 
 
 class PokemonSpecies:
@@ -18,7 +19,7 @@ class PokemonSpecies:
         self.types = types
         self.moves = moves
         self.name = name
-        self._instances = []
+        self._instances = Observers()
 
     def __str__(self):
         if self.name:
@@ -104,7 +105,7 @@ def calculate_stats(base_stats: Stats,
 
 
 class Pokemon:
-    __slots__ = ('species', 'moves', 'level', 'evs', 'ivs', 'nature', 'stats', '_views', '_move_indexes')
+    __slots__ = ('species', 'moves', 'level', 'evs', 'ivs', 'nature', 'stats', '_views', '_move_indexes', '__weakref__')
 
     def __init__(self,
                  species: PokemonSpecies,
@@ -121,17 +122,14 @@ class Pokemon:
         self.nature = nature
         self.stats = calculate_stats(self.species.base_stats, self.level, self.ivs, self.evs, self.nature)
         self._move_indexes = move_indexes
-        self._views = []
-        self.species._instances += [self]
+        self._views = Observers()
+        self.species._instances.add(self)
 
     def __str__(self):
         return ("Stats " + str(self.stats) +
                 ", Types " + str([t.name for t in self.species.types]) +
                 ", Moves " + str([str(m) for m in self.moves]))
 
-    def __del__(self):
-        self.species._instances.remove(self)
-
     def _base_edit(self):
         self.stats = calculate_stats(self.species.base_stats, self.level, self.ivs, self.evs, self.nature)
         self.moves = [self.species.moves[i] for i in self._move_indexes if 0 <= i < len(self._move_indexes)]
@@ -156,13 +154,14 @@ class Pokemon:
 
 
 class BattlingPokemon:
-    __slots__ = ('constants', 'hp', 'types', 'boosts', 'status', '_wake_turns', 'battling_moves', 'last_used_move',
-                 'protect', '_consecutive_protect', '_engine')
+    __slots__ = ('constants', '_hp', 'types', 'boosts', 'status', '_wake_turns', 'battling_moves', 'last_used_move',
+                 'protect', '_consecutive_protect', '_engine', '_team', '_key', '__weakref__')
 
     def __init__(self,
                  constants: Pokemon):
         self.constants = constants
-        self.hp = constants.stats[Stat.MAX_HP]
+        self._team = None
+        self._hp = constants.stats[Stat.MAX_HP]
         self.types = constants.species.types
         self.boosts = [0] * 8  # position 0 is not used
         self.status = Status.NONE
@@ -172,6 +171,7 @@ class BattlingPokemon:
         self.protect = False
         self._consecutive_protect = 0
         self._engine = None
+        self._key = 0  # Zobrist key, set by the engine
 
     def __str__(self):
         return ("Stats " + str(self.constants.stats) +
@@ -181,6 +181,17 @@ class BattlingPokemon:
                 (", " + self.status.name if self.status != Status.NONE else "") +
                 (", Moves " + str([str(m) for m in self.battling_moves])))
 
+    @property
+    def hp(self):
+        return self._hp
+
+    @hp.setter
+    def hp(self, hp):
+        # keep the team fainted counter up to date
+        if self._team is not None and (hp == 0) != (self._hp == 0):
+            self._team._n_fainted += 1 if hp == 0 else -1
+        self._hp = hp
+
     def reset(self):
         self.hp = self.constants.stats[Stat.MAX_HP]
         self.types = self.constants.species.types
@@ -194,7 +205,53 @@ class BattlingPokemon:
         self._consecutive_protect = 0
 
     def fainted(self) -> bool:
-        return self.hp == 0
+        return self._hp == 0
+
+    def _pack(self,
+              out: memoryview,
+              i: int):
+        types = self.types
+        out[i] = self._hp
+        out[i + 1] = types[0]
+        out[i + 2] = types[1] if len(types) > 1 else -1
+        for j, boost in enumerate(self.boosts, i + 3):
+            out[j] = boost
+        out[i + 11] = self.status
+        out[i + 12] = self._wake_turns
+        out[i + 13] = self.battling_moves.index(self.last_used_move) if self.last_used_move else -1
+        out[i + 14] = self.protect
+        out[i + 15] = self._consecutive_protect
+        i += 16
+        for move in self.battling_moves:
+            out[i] = move.pp
+            out[i + 1] = move.disabled
+            i += 2
+
+    def _unpack(self,
+                values: list,
+                i: int):
+        # enums and lists are rebuilt only when changed
+        hp = values[i]
+        if hp != self._hp:
+            self.hp = int(hp) if float(hp).is_integer() else hp
+        types = self.types
+        if values[i + 1] != types[0] or values[i + 2] != (types[1] if len(types) > 1 else -1):
+            self.types = [Type(int(t)) for t in values[i + 1:i + 3] if t >= 0]
+        boosts = values[i + 3:i + 11]
+        if boosts != self.boosts:
+            self.boosts = [int(b) for b in boosts]
+        if values[i + 11] != self.status:
+            self.status = Status(int(values[i + 11]))
+        self._wake_turns = int(values[i + 12])
+        last_used_move = int(values[i + 13])
+        self.last_used_move = self.battling_moves[last_used_move] if last_used_move >= 0 else None
+        self.protect = bool(values[i + 14])
+        self._consecutive_protect = int(values[i + 15])
+        i += 16
+        for move in self.battling_moves:
+            move.pp = int(values[i])
+            move.disabled = bool(values[i + 1])
+            i += 2
 
     def deal_damage(self,
                     damage: int):
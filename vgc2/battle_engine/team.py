@@ -1,3 +1,4 @@
+from vgc2.battle_engine.observers import Observers
 from vgc2.battle_engine.pokemon import BattlingPokemon, Pokemon
 
 
@@ -13,7 +14,8 @@ class Team:
 
 
 class BattlingTeam:
-    __slots__ = ('active', '_initial_active', 'reserve', '_initial_reserve', '_views', '_engine')
+    __slots__ = ('active', '_initial_active', 'reserve', '_initial_reserve', '_views', '_engine', '_n_fainted',
+                 '__weakref__')
 
     def __init__(self,
                  active: list[Pokemon] | list[BattlingPokemon],
@@ -22,13 +24,22 @@ class BattlingTeam:
         self._initial_active = self.active[:]
         self.reserve = ([BattlingPokemon(p) for p in reserve] if isinstance(reserve[0], Pokemon) else reserve) if len(
             reserve) > 0 else []
-        self._initial_reserve = self.active[:]
-        self._views = []
+        self._initial_reserve = self.reserve[:]
+        self._views = Observers()
         self._engine = None
+        self._n_fainted = 0
+        self._index()
 
     def __str__(self):
         return "Active " + str([str(a) for a in self.active]) + ", Reserve " + str([str(r) for r in self.reserve])
 
+    def _index(self):
+        # wire members to this team and recount the fainted ones, members keep the count updated on hp changes
+        self._n_fainted = 0
+        for pkm in self.active + self.reserve:
+            pkm._team = self
+            self._n_fainted += pkm.fainted()
+
     def reset(self):
         self.active = self._initial_active[:]
         self.reserve = self._initial_reserve[:]
@@ -36,6 +47,7 @@ class BattlingTeam:
             pkm.reset()
         for pkm in self.reserve:
             pkm.reset()
+        self._index()
 
     def switch(self,
                active_pos: int,
@@ -43,7 +55,7 @@ class BattlingTeam:
         if not 0 <= active_pos < len(self.active):
             return
         old_active = self.active[active_pos]
-        if all(p.fainted() for p in self.reserve) and old_active.fainted():  # active fainted and reserve fainted
+        if old_active.fainted() and self.first_from_reserve() == -1:  # active fainted and reserve fainted
             self.reserve += [self.active.pop(active_pos)]
             self._engine._on_switch(None, old_active)
             return
@@ -63,15 +75,37 @@ class BattlingTeam:
         for active in self.active:
             active.on_turn_end()
 
+    def _pack(self,
+              out: memoryview,
+              i: int,
+              slots: dict[int, int]):
+        # the number of active Pokémon and the slot in the State layout of the member at each position
+        out[i] = len(self.active)
+        for j, pkm in enumerate(self.active + self.reserve, i + 1):
+            out[j] = slots[id(pkm)]
+
+    def _unpack(self,
+                values: list,
+                i: int,
+                members: list[BattlingPokemon]):
+        n_active = int(values[i])
+        order = [members[int(k)] for k in values[i + 1:i + 1 + len(members)]]
+        if order[:n_active] != self.active or order[n_active:] != self.reserve:
+            self.active = order[:n_active]
+            self.reserve = order[n_active:]
+            self._index()
+
     def fainted(self) -> bool:
-        return all(p.fainted() for p in self.active + self.reserve)
+        return self._n_fainted == len(self.active) + len(self.reserve)
 
     def tie_breaker(self):
         return sum(p.hp for p in self.active + self.reserve)
 
     def get_active_pos(self,
                        pkm: BattlingPokemon) -> int:
-        return next((i for i, p in enumerate(self.active) if p == pkm), -1)
+        return self.active.index(pkm) if pkm in self.active else -1
 
     def first_from_reserve(self) -> int:
+        if self._n_fainted == 0:
+            return 0 if self.reserve else -1
         return next((i for i, p in enumerate(self.reserve) if not p.fainted()), -1)
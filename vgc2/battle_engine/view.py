@@ -1,4 +1,5 @@
-from vgc2.battle_engine.game_state import Side, State
+from vgc2.battle_engine.game_state import Side, State, SideConditions
+from vgc2.battle_engine.move import BattlingMove
 from vgc2.battle_engine.pokemon import Pokemon, BattlingPokemon
 from vgc2.battle_engine.team import Team, BattlingTeam
 
@@ -9,12 +10,9 @@ class PokemonView(Pokemon):
     def __init__(self,
                  pkm: Pokemon):
         self._pkm = pkm
-        self._pkm._views += [self]
+        self._pkm._views.add(self)
         self._revealed: list[int] = []
 
-    def __del__(self):
-        self._pkm._views.remove(self)
-
     def __getattr__(self,
                     attr):
         if attr == "moves":
@@ -31,6 +29,16 @@ class PokemonView(Pokemon):
     def hide(self):
         self._revealed = []
 
+    def snapshot(self) -> Pokemon:
+        """
+        Plain Pokémon holding what this view shows, the moves are the revealed ones.
+        """
+        pkm = self._pkm
+        snapshot = Pokemon(pkm.species, [], pkm.level, pkm.evs, pkm.ivs, pkm.nature)
+        snapshot.moves = [pkm.moves[i] for i in self._revealed]
+        snapshot._move_indexes = [pkm._move_indexes[i] for i in self._revealed]
+        return snapshot
+
 
 class BattlingPokemonView(BattlingPokemon):
     __slots__ = ('_pkm', '_constants_view', '_revealed')
@@ -40,12 +48,9 @@ class BattlingPokemonView(BattlingPokemon):
                  view: PokemonView | None = None):
         self._pkm = pkm
         self._constants_view = view if view else PokemonView(self._pkm.constants)
-        self._pkm.constants._views += [self]
+        self._pkm.constants._views.add(self)
         self._revealed: list[int] = []
 
-    def __del__(self):
-        self._pkm.constants._views.remove(self)
-
     def __getattr__(self,
                     attr):
         if attr == "_pkm":
@@ -64,6 +69,26 @@ class BattlingPokemonView(BattlingPokemon):
     def hide(self):
         self._revealed = []
 
+    def snapshot(self) -> BattlingPokemon:
+        pkm = self._pkm
+        snapshot = BattlingPokemon(self._constants_view.snapshot())
+        snapshot.hp = pkm.hp
+        snapshot.types = pkm.types
+        snapshot.boosts = pkm.boosts[:]
+        snapshot.status = pkm.status
+        snapshot._wake_turns = pkm._wake_turns
+        snapshot.battling_moves = []
+        for i in self._revealed:
+            move = BattlingMove(pkm.battling_moves[i].constants)
+            move.pp = pkm.battling_moves[i].pp
+            move.disabled = pkm.battling_moves[i].disabled
+            snapshot.battling_moves += [move]
+            if pkm.battling_moves[i] is pkm.last_used_move:
+                snapshot.last_used_move = move
+        snapshot.protect = pkm.protect
+        snapshot._consecutive_protect = pkm._consecutive_protect
+        return snapshot
+
 
 class TeamView(Team):
     __slots__ = ('_team', '_members')
@@ -100,10 +125,7 @@ class BattlingTeamView(BattlingTeam):
                        {p: BattlingPokemonView(p, v) for p, v in
                         zip(self._team.reserve, view.members[len(self._team.active):])})
         self._revealed: list[BattlingPokemon] = [p for p in self._team.active]
-        self._team._views += [self]
-
-    def __del__(self):
-        self._team._views.remove(self)
+        self._team._views.add(self)
 
     def __getattr__(self,
                     attr):
@@ -119,6 +141,10 @@ class BattlingTeamView(BattlingTeam):
         if switch_in and switch_in not in self._revealed:
             self._revealed += [switch_in]
 
+    def snapshot(self) -> BattlingTeam:
+        return BattlingTeam([self._views[p].snapshot() for p in self._team.active],
+                            [self._views[p].snapshot() for p in self._team.reserve if p in self._revealed])
+
 
 class SideView(Side):
     __slots__ = ('_side', '_team')
@@ -126,10 +152,7 @@ class SideView(Side):
     def __init__(self, side: Side, view: TeamView):
         self._side = side
         self._team = BattlingTeamView(self._side.team, view)
-        self._side._views += [self]
-
-    def __del__(self):
-        self._side._views.remove(self)
+        self._side._views.add(self)
 
     def __getattr__(self,
                     attr):
@@ -139,6 +162,12 @@ class SideView(Side):
             return self._team
         return getattr(self._side, attr)
 
+    def snapshot(self) -> Side:
+        conditions = SideConditions()
+        for f in SideConditions.__slots__:
+            setattr(conditions, f, getattr(self._side.conditions, f))
+        return Side(self._team.snapshot(), conditions)
+
 
 class StateView(State):
     __slots__ = ('_state', '_sides')
@@ -157,3 +186,18 @@ class StateView(State):
         if attr == "sides":
             return self._sides
         return getattr(self._state, attr)
+
+    def snapshot(self) -> State:
+        """
+        Materialize this view into plain objects, holding the same information without proxies. The own side is shared
+        as in the view, the opponent side is copied.
+        """
+        state = self._state
+        snapshot = State((self._sides[0], self._sides[1].snapshot()))
+        snapshot.weather = state.weather
+        snapshot._weather_turns = state._weather_turns
+        snapshot.field = state.field
+        snapshot._field_turns = state._field_turns
+        snapshot.trickroom = state.trickroom
+        snapshot._trickroom_turns = state._trickroom_turns
+        return snapshot
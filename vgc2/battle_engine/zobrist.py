@@ -0,0 +1,141 @@
+from math import ceil
+
+from vgc2.battle_engine.modifiers import Stat
+from vgc2.battle_engine.move import BattlingMove
+
+MASK = (1 << 64) - 1
+HP_BUCKETS = 64
+
+# features, boosts take one feature per stat and moves one per move slot
+HP, STATUS, PROTECT, ORDER, N_ACTIVE, WEATHER, FIELD, TRICKROOM = range(8)
+REFLECT, LIGHTSCREEN, TAILWIND, STEALTH_ROCK, POISON_SPIKES = range(8, 13)
+BOOSTS, PP, DISABLED = 16, 32, 48
+
+STATE_KEY = 0x243F6A8885A308D3
+
+
+def mix(x: int) -> int:
+    # splitmix64 finalizer
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9 & MASK
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EB & MASK
+    return x ^ (x >> 31)
+
+
+def zobrist(key: int,
+            feature: int,
+            value: int) -> int:
+    # mix inlined, this is called on every hashed mutation
+    x = key ^ (feature << 56) ^ (value & 0xFFFFFFFFFFFFFF)
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9 & MASK
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EB & MASK
+    return x ^ (x >> 31)
+
+
+def pokemon_key(side: int,
+                pkm) -> int:
+    # Pokémon are told apart by their constants, which copies of a State share
+    return (id(pkm.constants) << 1 | side) * 0x9E3779B97F4A7C15 & MASK
+
+
+SIDE_KEYS = (mix(STATE_KEY + 1), mix(STATE_KEY + 2))
+
+
+def hp_bucket(hp: int,
+              max_hp: int) -> int:
+    # any hp above zero lands in a bucket above zero
+    return ceil(hp * HP_BUCKETS / max_hp)
+
+
+def hp_hash(key: int,
+            hp: int,
+            max_hp: int) -> int:
+    return zobrist(key, HP, hp_bucket(hp, max_hp))
+
+
+def flag_hash(key: int,
+              feature: int,
+              value: int) -> int:
+    # unset flags, like empty squares, do not take part in the hash
+    return zobrist(key, feature, value) if value else 0
+
+
+def boosts_hash(key: int,
+                boosts: list[int]) -> int:
+    h = 0
+    for i in range(1, len(boosts)):
+        if boosts[i]:
+            h ^= zobrist(key, BOOSTS + i, boosts[i])
+    return h
+
+
+def pp_hash(key: int,
+            i: int,
+            pp: int) -> int:
+    return zobrist(key, PP + i, pp)
+
+
+def disabled_hash(key: int,
+                  moves: list[BattlingMove]) -> int:
+    h = 0
+    for i, move in enumerate(moves):
+        if move.disabled:
+            h ^= zobrist(key, DISABLED + i, 1)
+    return h
+
+
+def pokemon_hash(key: int,
+                 pkm) -> int:
+    h = (hp_hash(key, pkm.hp, pkm.constants.stats[Stat.MAX_HP]) ^ flag_hash(key, STATUS, pkm.status) ^
+         flag_hash(key, PROTECT, pkm.protect) ^ boosts_hash(key, pkm.boosts) ^ disabled_hash(key, pkm.battling_moves))
+    for i, move in enumerate(pkm.battling_moves):
+        h ^= pp_hash(key, i, move.pp)
+    return h
+
+
+def order_hash(side: int,
+               n_active: int,
+               members: list) -> int:
+    h = zobrist(SIDE_KEYS[side], N_ACTIVE, n_active)
+    for i, pkm in enumerate(members):
+        h ^= zobrist(pokemon_key(side, pkm), ORDER, i)
+    return h
+
+
+def conditions_hash(side: int,
+                    conditions) -> int:
+    key = SIDE_KEYS[side]
+    return (flag_hash(key, REFLECT, conditions.reflect) ^ flag_hash(key, LIGHTSCREEN, conditions.lightscreen) ^
+            flag_hash(key, TAILWIND, conditions.tailwind) ^ flag_hash(key, STEALTH_ROCK, conditions.stealth_rock) ^
+            flag_hash(key, POISON_SPIKES, conditions.poison_spikes))
+
+
+def field_hash(state) -> int:
+    return (flag_hash(STATE_KEY, WEATHER, state.weather) ^ flag_hash(STATE_KEY, FIELD, state.field) ^
+            flag_hash(STATE_KEY, TRICKROOM, state.trickroom))
+
+
+def turn_end_hash(state) -> int:
+    """
+    Hash of the features that may change at the end of a turn: field, screens, tailwind and protection. Pokémon keys
+    are those set by the BattleEngine.
+    """
+    h = field_hash(state) if state.weather or state.field or state.trickroom else 0
+    for side, s in enumerate(state.sides):
+        c = s.conditions
+        if c.reflect or c.lightscreen or c.tailwind:
+            key = SIDE_KEYS[side]
+            h ^= (flag_hash(key, REFLECT, c.reflect) ^ flag_hash(key, LIGHTSCREEN, c.lightscreen) ^
+                  flag_hash(key, TAILWIND, c.tailwind))
+        for pkm in s.team.active:
+            if pkm.protect:
+                h ^= zobrist(pkm._key, PROTECT, 1)
+    return h
+
+
+def state_hash(state) -> int:
+    h = field_hash(state)
+    for side, s in enumerate(state.sides):
+        h ^= order_hash(side, len(s.team.active), s.team.active + s.team.reserve) ^ conditions_hash(side, s.conditions)
+        for pkm in s.team.active + s.team.reserve:
+            h ^= pokemon_hash(pokemon_key(side, pkm), pkm)
+    return h
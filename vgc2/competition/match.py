@@ -18,9 +18,12 @@ def subteam(team: Team,
 def run_battle(engine: BattleEngine,
                agent: tuple[BattlePolicy, BattlePolicy],
                team_view: tuple[TeamView, TeamView],
-               view: tuple[StateView, StateView]) -> int:
+               view: tuple[StateView, StateView],
+               snapshot: bool = False) -> int:
+    # with snapshot, policies get their view materialized into a plain State when deciding
     while not engine.finished():
-        engine.run_turn((agent[0].decision(view[0], team_view[1]), agent[1].decision(view[1], team_view[0])))
+        engine.run_turn((agent[0].decision(view[0].snapshot() if snapshot else view[0], team_view[1]),
+                         agent[1].decision(view[1].snapshot() if snapshot else view[1], team_view[0])))
     return engine.winning_side
 
 
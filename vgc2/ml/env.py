@@ -1,16 +1,21 @@
+from itertools import product
 from typing import SupportsFloat, Any
 
 from gymnasium import Env
 from gymnasium.core import ActType, ObsType, RenderFrame
 from gymnasium.spaces import MultiDiscrete, Box
-from numpy import zeros
+from gymnasium.vector import VectorEnv
+from gymnasium.vector.utils import batch_space
+from numpy import zeros, ndarray, asarray, flatnonzero, take_along_axis, maximum, int64, arange
+from numpy.random import Generator
 
 from vgc2.agent import BattlePolicy
 from vgc2.agent.battle import RandomBattlePolicy
-from vgc2.battle_engine import BattleEngine, TeamView, State, BattlingTeam, StateView, BattleRuleParam
+from vgc2.battle_engine import BattleEngine, TeamView, State, BattlingTeam, StateView, BattleRuleParam, BattleCommand
+from vgc2.battle_engine.batch import BatchBattleEngine
 from vgc2.battle_engine.game_state import get_battle_teams
 from vgc2.competition.match import label_teams
-from vgc2.util.encoding import encode_state, EncodeContext
+from vgc2.util.encoding import encode_state, EncodeContext, EncodingSchema, encode_batch_engine
 from vgc2.util.generator import gen_team, TeamGenerator
 
 
@@ -25,6 +30,76 @@ def obs_encode_len(_encode_state,
     return _encode_state(e, state, EncodeContext())
 
 
+def action_table(n_active: int,
+                 max_team_size: int,
+                 max_pkm_moves: int) -> list[list[BattleCommand]]:
+    """
+    Joint commands of all active Pokémon indexed by dense action. Each Pokémon picks a move and a target, or a reserve
+    position to switch to, the first active Pokémon being the most significant digit of the index.
+    """
+    commands = ([(m, t) for m in range(max_pkm_moves) for t in range(n_active)] +
+                [(-1, r) for r in range(max_team_size - n_active)])
+    return [list(c) for c in product(commands, repeat=n_active)]
+
+
+def _joint_mask(masks: ndarray) -> ndarray:
+    # masks has one row of legal commands per active Pokémon, the joint mask is their outer product
+    joint = masks[..., 0, :]
+    for k in range(1, masks.shape[-2]):
+        joint = (joint[..., :, None] & masks[..., k, None, :]).reshape(masks.shape[:-2] + (-1,))
+    return joint
+
+
+def action_mask(state: State,
+                n_active: int,
+                max_team_size: int,
+                max_pkm_moves: int) -> ndarray:
+    """
+    Legal dense actions of side 0, as indexed by action_table. Moves without PP or disabled are illegal unless no move
+    is usable, as the engine then struggles, and so are missing targets and switches to fainted or missing Pokémon.
+    Commands of missing active Pokémon are ignored, only the first is kept legal.
+    """
+    team, n_targets = state.sides[0].team, max(len(state.sides[1].team.active), 1)
+    masks = zeros((n_active, max_pkm_moves * n_active + max_team_size - n_active), dtype=bool)
+    switches = [not p.fainted() for p in team.reserve[:max_team_size - n_active]]
+    for k, pkm in enumerate(team.active[:n_active]):
+        moves = [m.pp > 0 and not m.disabled for m in pkm.battling_moves[:max_pkm_moves]]
+        if not any(moves):
+            moves[:1] = [True]
+        for m, usable in enumerate(moves):
+            masks[k, m * n_active:m * n_active + n_targets] = usable
+        masks[k, max_pkm_moves * n_active:max_pkm_moves * n_active + len(switches)] = switches
+    masks[len(team.active):, 0] = True
+    return _joint_mask(masks)
+
+
+def batch_action_mask(engine: BatchBattleEngine,
+                      side: int,
+                      max_team_size: int,
+                      max_pkm_moves: int) -> ndarray:
+    """
+    action_mask of side for each battle of engine, computed from its arrays, with shape (n_battles, n_actions).
+    """
+    n, a = engine.n_battles, engine.max_active
+    slot = engine.order[:, side, :a]
+    m = arange(engine.pp.shape[3])
+    n_moves = take_along_axis(engine.n_moves[:, side], slot, 1)[..., None]
+    moves = ((m < n_moves) & (take_along_axis(engine.pp[:, side], slot[..., None], 1) > 0) &
+             ~take_along_axis(engine.disabled[:, side], slot[..., None], 1))[..., :max_pkm_moves]
+    moves[..., 0] |= ~moves.any(2)
+    targets = arange(a) < maximum(engine.n_active[:, 1 - side], 1)[:, None]
+    j = engine.n_active[:, side, None] + arange(max_team_size - a)
+    reserve = take_along_axis(engine.order[:, side], j.clip(max=engine.order.shape[2] - 1), 1)
+    switches = (j < engine.n_pkm[:, side, None]) & (take_along_axis(engine.hp[:, side], reserve, 1) > 0)
+    masks = zeros((n, a, max_pkm_moves * a + max_team_size - a), dtype=bool)
+    masks[..., :moves.shape[2] * a] = (moves[..., None] & targets[:, None, None]).reshape(n, a, -1)
+    masks[..., max_pkm_moves * a:] = switches[:, None]
+    absent = arange(a) >= engine.n_active[:, side, None]
+    masks[absent] = False
+    masks[absent, 0] = True
+    return _joint_mask(masks)
+
+
 class BattleEnv(Env):
 
     def __init__(self,
@@ -44,16 +119,22 @@ class BattleEnv(Env):
         self.opponent = opponent
         self.encode_state = _encode_state
         self.gen_team = gen_team
-        encode_len = obs_encode_len(self.encode_state, n_active, max_team_size, max_pkm_moves)
+        if self.encode_state is encode_state:
+            encode_len = EncodingSchema(ctx, max_team_size, max_pkm_moves).length
+        else:
+            encode_len = obs_encode_len(self.encode_state, n_active, max_team_size, max_pkm_moves)
         self.action_space = MultiDiscrete([max_pkm_moves + 1, max(max_team_size - n_active, n_active)] * n_active,
                                           start=[-1, 0] * n_active)
         self.observation_space = Box(-1., 1., (1, encode_len))  # TODO gym define obs limits per dim
         self.engine, self.state_view = self._get_engine_view()
         self.encode_buffer = zeros(encode_len)
+        self.action_table = action_table(n_active, max_team_size, max_pkm_moves)
 
-    def _get_engine_view(self) -> tuple[BattleEngine, tuple[StateView, StateView]]:
-        team = (self.gen_team(self.max_team_size, self.max_pkm_moves),
-                self.gen_team(self.max_team_size, self.max_pkm_moves))
+    def _get_engine_view(self,
+                         rng: Generator | None = None) -> tuple[BattleEngine, tuple[StateView, StateView]]:
+        rng_args = () if rng is None else (rng,)
+        team = (self.gen_team(self.max_team_size, self.max_pkm_moves, *rng_args),
+                self.gen_team(self.max_team_size, self.max_pkm_moves, *rng_args))
         label_teams(team)
         team_view = TeamView(team[0]), TeamView(team[1])
         state = State(get_battle_teams(team, self.n_active))
@@ -80,6 +161,10 @@ class BattleEnv(Env):
               *,
               seed: int | None = None,
               options: dict[str, Any] | None = None) -> tuple[ObsType, dict[str, Any]]:
+        super().reset(seed=seed)
+        if seed is not None:
+            # teams are drawn again from the seeded generator, so that a seeded reset always starts the same battle
+            self.engine, self.state_view = self._get_engine_view(self.np_random)
         self.engine.reset()
         observation = self._get_obs()
         info = self._get_info()
@@ -96,4 +181,127 @@ class BattleEnv(Env):
         return self.encode_buffer
 
     def _get_info(self):
-        return {}
+        return {'action_mask': action_mask(self.engine.state, self.n_active, self.max_team_size, self.max_pkm_moves)}
+
+
+def random_batch_commands(engine: BatchBattleEngine,
+                          side: int,
+                          rng: Generator,
+                          switch_prob: float = .15) -> ndarray:
+    """
+    Commands of side in each battle of engine drawn as RandomBattlePolicy does, with shape (n_battles, max_active, 2).
+    """
+    n, a = engine.n_battles, engine.max_active
+    n_moves = take_along_axis(engine.n_moves[:, side], engine.order[:, side, :a], 1)
+    n_switches = (engine.n_pkm[:, side] - engine.n_active[:, side])[:, None]
+    n_targets = maximum(engine.n_active[:, 1 - side], 1)[:, None]
+    switch = (n_switches > 0) & (rng.random((n, a)) < switch_prob)
+    u = rng.random((n, a))
+    commands = zeros((n, a, 2), dtype=int64)
+    commands[..., 0] = (u * n_moves).astype(int64)
+    commands[..., 0][switch] = -1
+    commands[..., 1] = (rng.random((n, a)) * (n_switches * switch + n_targets * ~switch)).astype(int64)
+    return commands
+
+
+class BattleVectorEnv(VectorEnv):
+    """
+    num_envs battles run by a BatchBattleEngine and stepped in one call. Observations are encoded as BattleEnv does,
+    from the view of side 0, into the rows of a single array. A battle that ends is auto-reset with freshly generated
+    teams on the next step, where its action is ignored. Without an opponent policy, opponent commands are drawn as
+    RandomBattlePolicy does for all battles at once, otherwise the opponent decides all pending battles with one
+    decision_batch call.
+    """
+
+    def __init__(self,
+                 ctx: EncodeContext,
+                 num_envs: int = 64,
+                 n_active: int = 2,
+                 max_team_size: int = 4,
+                 max_pkm_moves: int = 4,
+                 params: BattleRuleParam = BattleRuleParam(),
+                 opponent: BattlePolicy | None = None,
+                 turn_limit: int = 100,
+                 _gen_team: TeamGenerator = gen_team):
+        self.ctx = ctx
+        self.num_envs = num_envs
+        self.n_active = n_active
+        self.max_team_size = max_team_size
+        self.max_pkm_moves = max_pkm_moves
+        self.params = params
+        self.opponent = opponent
+        self.turn_limit = turn_limit
+        self.gen_team = _gen_team
+        encode_len = EncodingSchema(ctx, max_team_size, max_pkm_moves).length
+        self.single_action_space = MultiDiscrete([max_pkm_moves + 1, max(max_team_size - n_active, n_active)] *
+                                                 n_active, start=[-1, 0] * n_active)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        self.single_observation_space = Box(-1., 1., (encode_len,))
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.engine: BatchBattleEngine | None = None
+        self.state_view: list[StateView] = []
+        self.encode_buffer = zeros((num_envs, encode_len))
+        self.commands = zeros((num_envs, 2, n_active, 2), dtype=int64)
+        self._autoreset = zeros(num_envs, dtype=bool)
+        self.action_table = action_table(n_active, max_team_size, max_pkm_moves)
+
+    def _gen_battles(self,
+                     n: int) -> tuple[list[State], list[StateView]]:
+        states, views = [], []
+        for _ in range(n):
+            team = (self.gen_team(self.max_team_size, self.max_pkm_moves, self.np_random),
+                    self.gen_team(self.max_team_size, self.max_pkm_moves, self.np_random))
+            label_teams(team)
+            state = State(get_battle_teams(team, self.n_active))
+            states += [state]
+            views += [StateView(state, 1, (TeamView(team[0]), TeamView(team[1])))]
+        return states, views
+
+    def set_opponent(self, opponent: BattlePolicy | None):
+        self.opponent = opponent
+
+    def step(self,
+             actions: ActType) -> tuple[ObsType, ndarray, ndarray, ndarray, dict[str, Any]]:
+        engine = self.engine
+        self.commands[:, 0] = asarray(actions).reshape(self.num_envs, self.n_active, 2)
+        self.commands[:, 1] = self._opponent_commands()
+        engine.run_turn(self.commands)
+        b = flatnonzero(self._autoreset)
+        if b.size:
+            states, views = self._gen_battles(b.size)
+            engine.load(b, states)
+            for i, view in zip(b, views):
+                self.state_view[i] = view
+        terminated = engine.terminal()
+        truncated = ~terminated & (engine.turn >= self.turn_limit)
+        self._autoreset = terminated | truncated
+        reward = (engine.winning_side == 0).astype(float)  # the agent is only reached at the end of the episode
+        return self._get_obs(), reward, terminated, truncated, self._get_info()
+
+    def reset(self,
+              *,
+              seed: int | None = None,
+              options: dict[str, Any] | None = None) -> tuple[ObsType, dict[str, Any]]:
+        super().reset(seed=seed)
+        states, self.state_view = self._gen_battles(self.num_envs)
+        self.engine = BatchBattleEngine(states, self.params, self.np_random, self.turn_limit)
+        self._autoreset[:] = False
+        return self._get_obs(), self._get_info()
+
+    def _opponent_commands(self) -> ndarray:
+        if self.opponent is None:
+            return random_batch_commands(self.engine, 1, self.np_random)
+        # all battles still running are decided with a single call, on their views
+        self.engine.sync_states()
+        commands = zeros((self.num_envs, self.n_active, 2), dtype=int64)
+        pending = flatnonzero(~self.engine.finished())
+        for i, cmds in zip(pending, self.opponent.decision_batch([self.state_view[i] for i in pending])):
+            for j, cmd in enumerate(cmds):
+                commands[i, j] = cmd
+        return commands
+
+    def _get_obs(self) -> ndarray:
+        return encode_batch_engine(self.encode_buffer, self.engine, self.ctx, 0)
+
+    def _get_info(self) -> dict[str, Any]:
+        return {'action_mask': batch_action_mask(self.engine, 0, self.max_team_size, self.max_pkm_moves)}
@@ -0,0 +1,190 @@
+import multiprocessing as mp
+import os
+import pickle
+import random
+import traceback
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Sequence
+
+from gymnasium.core import ObsType
+from gymnasium.spaces import Box
+from gymnasium.vector import VectorEnv
+from gymnasium.vector.utils import batch_space, CloudpickleWrapper
+from numpy import ndarray, frombuffer, int64, float64, bool_, prod
+from numpy.random import seed, SeedSequence
+
+from vgc2.battle_engine import _RNG as _ENGINE_RNG
+from vgc2.ml.env import BattleEnv
+from vgc2.util.generator import _RNG as _GEN_RNG
+
+_RESET, _STEP, _CLOSE = b'r', b's', b'c'
+
+
+def _shared_arrays(shared: tuple,
+                   num_envs: int,
+                   obs_len: int,
+                   action_len: int,
+                   n_actions: int) -> tuple[ndarray, ...]:
+    obs, actions, rewards, terminated, truncated, masks = shared
+    return (frombuffer(obs, dtype=float64).reshape(num_envs, obs_len),
+            frombuffer(actions, dtype=int64).reshape(num_envs, action_len),
+            frombuffer(rewards, dtype=float64),
+            frombuffer(terminated, dtype=bool_),
+            frombuffer(truncated, dtype=bool_),
+            frombuffer(masks, dtype=bool_).reshape(num_envs, n_actions))
+
+
+def _seed_worker(seq: SeedSequence | None,
+                 n_envs: int) -> list[int | None]:
+    # without a seed sequence generators are reseeded from fresh entropy, workers forked from the same process would
+    # otherwise draw the same random numbers, returns the seeds of the worker envs
+    if seq is None:
+        random.seed()
+        seed()
+        for rng in (_ENGINE_RNG, _GEN_RNG):
+            rng.bit_generator.state = type(rng.bit_generator)().state
+        return [None] * n_envs
+    py_seq, np_seq, engine_seq, gen_seq, env_seq = seq.spawn(5)
+    random.seed(int(py_seq.generate_state(1)[0]))
+    seed(int(np_seq.generate_state(1)[0]))
+    for rng, rng_seq in ((_ENGINE_RNG, engine_seq), (_GEN_RNG, gen_seq)):
+        rng.bit_generator.state = type(rng.bit_generator)(rng_seq).state
+    return env_seq.generate_state(n_envs).tolist()
+
+
+def _worker(env_fns: CloudpickleWrapper,
+            start: int,
+            shared: tuple,
+            shape: tuple[int, int, int, int],
+            conn: Connection):
+    _seed_worker(None, 0)
+    obs, actions, rewards, terminated, truncated, masks = _shared_arrays(shared, *shape)
+    envs: list[BattleEnv] = [fn() for fn in env_fns.fn]
+    for i, env in enumerate(envs):
+        env.encode_buffer = obs[start + i]  # observations are encoded straight into shared memory
+    autoreset = [False] * len(envs)
+    while True:
+        command = conn.recv_bytes()
+        try:
+            if command == _CLOSE:
+                for env in envs:
+                    env.close()
+                conn.send_bytes(b'')
+                break
+            # a reset may carry the seed sequence of this worker
+            reset = command[:1] == _RESET
+            env_seeds = [None] * len(envs)
+            if reset and len(command) > 1:
+                env_seeds = _seed_worker(pickle.loads(command[1:]), len(envs))
+            for i, env in enumerate(envs):
+                j = start + i
+                if reset or autoreset[i]:
+                    _, info = env.reset(seed=env_seeds[i])
+                    rewards[j], terminated[j], truncated[j] = 0., False, False
+                else:
+                    _, rewards[j], terminated[j], truncated[j], info = env.step(actions[j])
+                masks[j] = info['action_mask']
+                autoreset[i] = bool(terminated[j] or truncated[j])
+            conn.send_bytes(b'')
+        except Exception:
+            conn.send_bytes(traceback.format_exc().encode())
+    conn.close()
+
+
+class SharedMemoryVectorEnv(VectorEnv):
+    """
+    BattleEnvs stepped in worker processes, each worker running a contiguous group of them. Workers encode observations
+    and write rewards and done flags straight into shared arrays, and read their actions from a shared array, only
+    single byte commands, and seeds on reset, go through the pipes. Finished environments are reset on the next step, as in gymnasium's
+    vector envs. Workers are forked from a server that has preloaded the environment modules where available. A reset
+    with a seed reseeds the workers, their environments and the generators of the battle engine and team generator
+    from it, for reproducible runs.
+    """
+
+    def __init__(self,
+                 env_fns: Sequence[Callable[[], BattleEnv]],
+                 n_workers: int | None = None,
+                 copy: bool = True,
+                 context: str | None = None):
+        self.num_envs = len(env_fns)
+        self.copy = copy
+        env = env_fns[0]()
+        obs_len = int(prod(env.observation_space.shape))
+        action_len = len(env.action_space.nvec)
+        n_actions = len(env.action_table)
+        self.single_observation_space = Box(-1., 1., (obs_len,))
+        self.observation_space = batch_space(self.single_observation_space, self.num_envs)
+        self.single_action_space = env.action_space
+        self.action_space = batch_space(self.single_action_space, self.num_envs)
+        env.close()
+        if context is None:
+            context = 'forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn'
+        ctx = mp.get_context(context)
+        if context == 'forkserver':
+            ctx.set_forkserver_preload([__name__])
+        shape = self.num_envs, obs_len, action_len, n_actions
+        self._shared = (ctx.RawArray('d', self.num_envs * obs_len), ctx.RawArray('q', self.num_envs * action_len),
+                        ctx.RawArray('d', self.num_envs), ctx.RawArray('b', self.num_envs),
+                        ctx.RawArray('b', self.num_envs), ctx.RawArray('b', self.num_envs * n_actions))
+        (self.observations, self.actions, self.rewards, self.terminated, self.truncated,
+         self.action_masks) = _shared_arrays(self._shared, *shape)
+        self.action_table = env.action_table
+        n_workers = min(self.num_envs, n_workers or os.cpu_count() or 1)
+        bounds = [self.num_envs * w // n_workers for w in range(n_workers + 1)]
+        self.conns: list[Connection] = []
+        self.processes: list[mp.Process] = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=_worker, args=(CloudpickleWrapper(env_fns[start:stop]), start, self._shared,
+                                                        shape, child_conn), daemon=True)
+            process.start()
+            child_conn.close()
+            self.conns += [conn]
+            self.processes += [process]
+
+    def _call(self,
+              command: bytes | list[bytes]):
+        # a list holds one command per worker
+        commands = command if isinstance(command, list) else [command] * len(self.conns)
+        for conn, _command in zip(self.conns, commands):
+            conn.send_bytes(_command)
+        errors = [conn.recv_bytes() for conn in self.conns]
+        errors = [e.decode() for e in errors if e]
+        if errors:
+            raise RuntimeError('Worker failed:\n' + errors[0])
+
+    def _get_obs(self) -> ndarray:
+        return self.observations.copy() if self.copy else self.observations
+
+    def _get_info(self) -> dict[str, Any]:
+        return {'action_mask': self.action_masks.copy()}
+
+    def reset(self,
+              *,
+              seed: int | None = None,
+              options: dict[str, Any] | None = None) -> tuple[ObsType, dict[str, Any]]:
+        super().reset(seed=seed)
+        if seed is None:
+            self._call(_RESET)
+        else:
+            # each worker seeds its generators and environments from its own branch of the seed
+            self._call([_RESET + pickle.dumps(seq) for seq in SeedSequence(seed).spawn(len(self.conns))])
+        return self._get_obs(), self._get_info()
+
+    def step(self,
+             actions: ndarray) -> tuple[ObsType, ndarray, ndarray, ndarray, dict[str, Any]]:
+        self.actions[:] = actions
+        self._call(_STEP)
+        return (self._get_obs(), self.rewards.copy(), self.terminated.copy(), self.truncated.copy(),
+                self._get_info())
+
+    def close_extras(self, **kwargs: Any):
+        for conn, process in zip(self.conns, self.processes):
+            if process.is_alive():
+                try:
+                    conn.send_bytes(_CLOSE)
+                    conn.recv_bytes()
+                except (BrokenPipeError, EOFError):
+                    pass
+            conn.close()
+            process.join()
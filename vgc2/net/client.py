@@ -21,6 +21,11 @@ class ProxyBattlePolicy(BattlePolicy):
         self.__conn.send(('BattlePolicy', state, opp_view))
         return self.__conn.recv()
 
+    def decision_batch(self,
+                       states: list[State]) -> list[list[BattleCommand]]:
+        self.__conn.send(('BattlePolicyBatch', states))
+        return self.__conn.recv()
+
 
 class ProxySelectionPolicy(SelectionPolicy):
 
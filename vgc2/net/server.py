@@ -45,6 +45,8 @@ class RemoteCompetitorManager(RemoteManager):
         match msg[0]:
             case 'BattlePolicy':
                 self.conn.send(self.competitor.battle_policy.decision(msg[1], msg[2]))
+            case 'BattlePolicyBatch':
+                self.conn.send(self.competitor.battle_policy.decision_batch(msg[1]))
             case 'SelectionPolicy':
                 self.conn.send(self.competitor.selection_policy.decision(msg[1], msg[2]))
             case 'TeamBuildPolicy':
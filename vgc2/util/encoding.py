@@ -1,5 +1,11 @@
-from numpy import array
+from weakref import WeakKeyDictionary
 
+from typing import Sequence
+
+from numpy import array, zeros, ndarray, arange, cumsum, take_along_axis, argsort, where
+
+from vgc2.battle_engine.batch import BatchBattleEngine, _REFLECT, _LIGHTSCREEN, _TAILWIND, _STEALTH_ROCK, \
+    _POISON_SPIKES, _WEATHER, _FIELD, _TRICKROOM
 from vgc2.battle_engine.game_state import Side, State
 from vgc2.battle_engine.modifiers import Weather, Terrain, Hazard, Status
 from vgc2.battle_engine.move import Move, BattlingMove
@@ -35,7 +41,7 @@ def multi_hot(e: array,
 
 class EncodeContext:
     __slots__ = ('max_hp', 'max_pp', 'max_stage', 'max_priority', 'n_types', 'n_status', 'n_weather', 'n_terrain',
-                 'n_hazard', 'max_boost', 'n_boosts', 'max_ratio', 'n_category', 'n_stats', 'max_sleep')
+                 'n_hazard', 'max_boost', 'n_boosts', 'max_ratio', 'n_category', 'n_stats', 'max_sleep', '_cache')
 
     def __init__(self,
                  max_hp: int = 500,
@@ -68,11 +74,39 @@ class EncodeContext:
         self.n_category = n_category
         self.n_stats = n_stats
         self.max_sleep = max_sleep
+        # static encodings of moves and Pokémon stats, computed once per object
+        self._cache = WeakKeyDictionary()
+
+    def __getstate__(self):
+        # the cache is not kept when pickled
+        return {f: getattr(self, f) for f in self.__slots__ if f != '_cache'}
+
+    def __setstate__(self,
+                     state: dict):
+        for f, v in state.items():
+            setattr(self, f, v)
+        self._cache = WeakKeyDictionary()
+
+
+def move_encode_len(ctx: EncodeContext) -> int:
+    return 18 + ctx.n_boosts + ctx.n_types + ctx.n_category + ctx.n_weather + ctx.n_terrain + ctx.n_hazard
 
 
 def encode_move(e: array,
                 move: Move,
                 ctx: EncodeContext) -> int:
+    cached = ctx._cache.get(move)
+    if cached is None:
+        cached = zeros(move_encode_len(ctx))
+        _encode_move(cached, move, ctx)
+        ctx._cache[move] = cached
+    e[:len(cached)] = cached
+    return len(cached)
+
+
+def _encode_move(e: array,
+                 move: Move,
+                 ctx: EncodeContext) -> int:
     i = 0
     e[i] = move.base_power / ctx.max_hp
     i += 1
@@ -144,20 +178,28 @@ def encode_pokemon(e: array,
     i = 0
     for m in pokemon.moves:
         i += encode_move(e[i:], m, ctx)
-    for j in range(0, ctx.n_stats):
-        e[j + i] = pokemon.stats[j] / ctx.max_hp
-    i += ctx.n_stats
+    i += encode_stats(e[i:], pokemon, ctx)
     i += multi_hot(e, pokemon.species.types, ctx.n_types)
     return i
 
 
+def encode_stats(e: array,
+                 pokemon: Pokemon,
+                 ctx: EncodeContext) -> int:
+    stats = pokemon.stats
+    cached = ctx._cache.get(pokemon)
+    # stats change only when the Pokémon is edited, which replaces the stats tuple
+    if cached is None or cached[0] is not stats:
+        cached = stats, array(stats[:ctx.n_stats]) / ctx.max_hp
+        ctx._cache[pokemon] = cached
+    e[:ctx.n_stats] = cached[1]
+    return ctx.n_stats
+
+
 def encode_battling_pokemon(e: array,
                             pokemon: BattlingPokemon,
                             ctx: EncodeContext) -> int:
-    i = 0
-    for j in range(0, ctx.n_stats):
-        e[j + i] = pokemon.constants.stats[j] / ctx.max_hp
-    i += ctx.n_stats
+    i = encode_stats(e, pokemon.constants, ctx)
     for m in pokemon.battling_moves:
         i += encode_battling_move(e[i:], m, ctx)
     e[i] = pokemon.hp / ctx.max_hp
@@ -175,6 +217,67 @@ def encode_battling_pokemon(e: array,
     return i
 
 
+class EncodingSchema:
+    """
+    Layout of encode_state for teams of team_size Pokémon with n_moves moves each. Pokémon are numbered by their
+    position in active + reserve, slices of a Pokémon fields and side conditions are relative to their block. The
+    types of a Pokémon are written over the start of its block.
+    """
+    __slots__ = ('ctx', 'team_size', 'n_moves', 'move_len', 'battling_move_len', 'pokemon_len', 'side_len', 'length',
+                 'pokemon_fields', 'condition_fields', 'weather', 'field', 'trickroom')
+
+    def __init__(self,
+                 ctx: EncodeContext,
+                 team_size: int = 4,
+                 n_moves: int = 4):
+        self.ctx = ctx
+        self.team_size = team_size
+        self.n_moves = n_moves
+        self.move_len = move_encode_len(ctx)
+        self.battling_move_len = self.move_len + 2
+        i = ctx.n_stats + n_moves * self.battling_move_len
+        self.pokemon_fields = {'stats': slice(0, ctx.n_stats),
+                               'moves': slice(ctx.n_stats, i),
+                               'hp': slice(i, i + 1),
+                               'types': slice(0, ctx.n_types),
+                               'boosts': slice(i + ctx.n_types, i + ctx.n_types + ctx.n_boosts)}
+        i += ctx.n_types + ctx.n_boosts
+        self.pokemon_fields |= {'status': slice(i, i + ctx.n_status),
+                                'protect': slice(i + ctx.n_status, i + ctx.n_status + 1),
+                                'wake_turns': slice(i + ctx.n_status + 1, i + ctx.n_status + 2)}
+        self.pokemon_len = i + ctx.n_status + 2
+        self.condition_fields = {f: slice(j, j + 1) for j, f in
+                                 enumerate(('reflect', 'lightscreen', 'tailwind', 'stealth_rock', 'poison_spikes'))}
+        self.side_len = team_size * self.pokemon_len + len(self.condition_fields)
+        i = 2 * self.side_len
+        self.weather = slice(i, i + ctx.n_weather)
+        self.field = slice(i + ctx.n_weather, i + ctx.n_weather + ctx.n_terrain)
+        self.trickroom = slice(self.field.stop, self.field.stop + 1)
+        self.length = self.trickroom.stop
+
+    def side(self,
+             side: int) -> slice:
+        return slice(side * self.side_len, (side + 1) * self.side_len)
+
+    def pokemon(self,
+                side: int,
+                pos: int) -> slice:
+        start = side * self.side_len + pos * self.pokemon_len
+        return slice(start, start + self.pokemon_len)
+
+    def move(self,
+             side: int,
+             pos: int,
+             move: int) -> slice:
+        start = side * self.side_len + pos * self.pokemon_len + self.ctx.n_stats + move * self.battling_move_len
+        return slice(start, start + self.battling_move_len)
+
+    def conditions(self,
+                   side: int) -> slice:
+        start = side * self.side_len + self.team_size * self.pokemon_len
+        return slice(start, start + len(self.condition_fields))
+
+
 def encode_team(e: array,
                 team: Team,
                 ctx: EncodeContext) -> int:
@@ -228,3 +331,113 @@ def encode_state(e: array,
     e[i] = float(state.trickroom)
     i += 1
     return i
+
+
+def encode_states(out: ndarray,
+                  states: Sequence[State],
+                  ctx: EncodeContext) -> ndarray:
+    """
+    Encode each state into a row of out, as encode_state does into a zeroed buffer.
+    """
+    out[:len(states)] = 0.
+    for row, state in zip(out, states):
+        encode_state(row, state, ctx)
+    return out
+
+
+def _scatter(e: ndarray,
+             mask: ndarray,
+             rows: ndarray,
+             cols: ndarray,
+             values: ndarray | float):
+    # masked values are written into the last column of e, which is left out of the encoding
+    e[rows, where(mask, cols, -1)] = values
+
+
+def encode_batch_engine(out: ndarray,
+                        engine: BatchBattleEngine,
+                        ctx: EncodeContext,
+                        side: int | None = None) -> ndarray:
+    """
+    Encode the current state of each battle of engine into a row of out, the same as encode_state on its synced State.
+    If side is given, the battles are encoded as seen by that side, the same as encode_state on a StateView.
+    """
+    n = engine.n_battles
+    e = zeros((n, out.shape[1] + 1))
+    battling_move_len = move_encode_len(ctx) + 2
+    cached = ctx._cache.get(engine)
+    if cached is None or cached[0] is not engine.move_list:
+        # only rows of move_list replaced since the last call are encoded
+        move_list, move_table = cached if cached is not None else ((), zeros((0, battling_move_len - 2)))
+        cached = engine.move_list, zeros((len(engine.move_list), battling_move_len - 2))
+        cached[1][:len(move_table)] = move_table[:len(engine.move_list)]
+        for i, move in enumerate(engine.move_list):
+            if i >= len(move_list) or move_list[i] is not move:
+                encode_move(cached[1][i], move, ctx)
+        ctx._cache[engine] = cached
+    move_table = cached[1]
+    sides = [0, 1] if side is None else [side, 1 - side]
+    # Pokémon fields, in the current active + reserve order of each side
+    slot = engine.order[:, sides]
+    present = arange(slot.shape[2])[None, None] < engine.n_pkm[:, sides, None]
+    n_moves = take_along_axis(engine.n_moves[:, sides], slot, 2)
+
+    def take(a: ndarray) -> ndarray:
+        return take_along_axis(a[:, sides], slot.reshape(slot.shape + (1,) * (a.ndim - 3)), 2)
+
+    moves, pp, disabled = take(engine.moves), take(engine.pp), take(engine.disabled)
+    if side is not None:
+        # the opponent shows its active and revealed Pokémon, with its revealed moves in order of use
+        present[:, 1] &= ((arange(slot.shape[2])[None] < engine.n_active[:, sides[1], None]) |
+                          take(engine.revealed)[:, 1])
+        rank = take(engine.move_rank)[:, 1]
+        n_moves[:, 1] = (rank >= 0).sum(2)
+        used = argsort(where(rank >= 0, rank, rank.shape[2]), 2, kind='stable')
+        moves[:, 1], pp[:, 1], disabled[:, 1] = (take_along_axis(moves[:, 1], used, 2),
+                                                 take_along_axis(pp[:, 1], used, 2),
+                                                 take_along_axis(disabled[:, 1], used, 2))
+    length = (ctx.n_stats + n_moves * battling_move_len + ctx.n_types + ctx.n_boosts + ctx.n_status + 2) * present
+    side_len = length.sum(2) + 5
+    side_start = zeros((n, 2), dtype=int)
+    side_start[:, 1] = side_len[:, 0]
+    start = (side_start[:, :, None] + cumsum(length, 2) - length)[..., None]
+    rows = arange(n)[:, None, None, None]
+    mask = present[..., None]
+    _scatter(e, mask, rows, start + arange(ctx.n_stats), take(engine.stats)[..., :ctx.n_stats] / ctx.max_hp)
+    for k in range(moves.shape[3]):
+        move_start = start + ctx.n_stats + k * battling_move_len
+        move_mask = mask & (k < n_moves[..., None])
+        _scatter(e, move_mask, rows, move_start + arange(battling_move_len - 2), move_table[moves[..., k]])
+        _scatter(e, move_mask, rows, move_start + battling_move_len - 2, disabled[..., k, None].astype(float))
+        _scatter(e, move_mask, rows, move_start + battling_move_len - 1, pp[..., k, None] / ctx.max_pp)
+    i = start + ctx.n_stats + n_moves[..., None] * battling_move_len
+    _scatter(e, mask, rows, i, take(engine.hp)[..., None] / ctx.max_hp)
+    types = take(engine.types)
+    _scatter(e, mask, rows, start + arange(ctx.n_types),
+             ((arange(ctx.n_types) == types[..., :1]) | (arange(ctx.n_types) == types[..., 1:])).astype(float))
+    i = i + ctx.n_types
+    _scatter(e, mask, rows, i + arange(ctx.n_boosts), take(engine.boosts)[..., :ctx.n_boosts] / ctx.max_boost)
+    i = i + ctx.n_boosts
+    status = take(engine.status)[..., None]
+    _scatter(e, mask & (status != Status.NONE), rows, i + arange(ctx.n_status),
+             (arange(ctx.n_status) == status).astype(float))
+    i = i + ctx.n_status
+    _scatter(e, mask, rows, i, take(engine.protect)[..., None].astype(float))
+    _scatter(e, mask, rows, i + 1, take(engine.wake_turns)[..., None] / ctx.max_sleep)
+    # side conditions and field
+    rows = arange(n)[:, None]
+    conditions = side_start + side_len - 5
+    for j, c in enumerate((_REFLECT, _LIGHTSCREEN, _TAILWIND, _STEALTH_ROCK, _POISON_SPIKES)):
+        e[rows, conditions + j] = engine.conditions[:, sides, c] != 0
+    i = side_start[:, 1:] + side_len[:, 1:]
+    weather = engine.field[:, _WEATHER, None]
+    _scatter(e, weather != Weather.CLEAR, rows, i + arange(ctx.n_weather),
+             (arange(ctx.n_weather) == weather - 1).astype(float))
+    i = i + ctx.n_weather
+    field = engine.field[:, _FIELD, None]
+    _scatter(e, field != Terrain.NONE, rows, i + arange(ctx.n_terrain),
+             (arange(ctx.n_terrain) == field - 1).astype(float))
+    i = i + ctx.n_terrain
+    e[rows, i] = engine.field[:, _TRICKROOM, None] != 0
+    out[:n] = e[:, :-1]
+    return out
@@ -66,6 +66,11 @@ def forward(state: State,
             params: BattleRuleParam = BattleRuleParam(),
             acc_rng: tuple[tuple[Generator, ...], tuple[Generator, ...]] = ((_RNG, _RNG), (_RNG, _RNG)),
             eff_rng: tuple[tuple[Generator, ...], tuple[Generator, ...]] = ((_RNG, _RNG), (_RNG, _RNG)),
-            sta_rng: tuple[tuple[Generator, ...], tuple[Generator, ...]] = ((_RNG, _RNG), (_RNG, _RNG))):
-    new_engine = BattleEngine(state, params, acc_rng, eff_rng, sta_rng)
-    new_engine.run_turn(commands)
+            sta_rng: tuple[tuple[Generator, ...], tuple[Generator, ...]] = ((_RNG, _RNG), (_RNG, _RNG)),
+            engine: BattleEngine | None = None):
+    # a given engine is rebound to state and runs with its own params and RNG sources
+    if engine is None:
+        engine = BattleEngine(state, params, acc_rng, eff_rng, sta_rng)
+    else:
+        engine.bind(state)
+    engine.run_turn(commands)
@@ -1,6 +1,8 @@
+from itertools import chain
+
 import numpy as np
 from numpy import full, copyto
-from numpy.random import Generator, PCG64
+from numpy.random import Generator, PCG64, SeedSequence
 
 
 class DeterministicGenerator(Generator):
@@ -21,6 +23,41 @@ class DeterministicGenerator(Generator):
         return result
 
 
+class BufferedGenerator(Generator):
+    """
+    Generator that draws uniforms in blocks and hands them out on each scalar random() call. Any other draw goes to the
+    underlying PCG64 stream.
+    """
+
+    def __init__(self, seed=None, block: int = 1024):
+        super().__init__(PCG64(seed))
+        self.block = block
+        self._values = chain.from_iterable(iter(self._draw_block, None))
+
+    def __str__(self):
+        return "BufferedGenerator(" + str(self.block) + ")"
+
+    def _draw_block(self) -> list[float]:
+        return super().random(self.block).tolist()
+
+    def random(self, size=None, dtype=float, out=None):
+        if size is None and out is None and dtype is float:
+            return next(self._values)
+        return super().random(size, dtype, out)
+
+
+def buffered_rng(seed=None,
+                 n_active: int = 2,
+                 block: int = 1024) -> tuple[tuple[tuple[Generator, ...], tuple[Generator, ...]], ...]:
+    """
+    Independent BufferedGenerator streams for the accuracy, effect and status rolls of each side and active position of
+    a battle, to be passed as BattleEngine acc_rng, eff_rng and sta_rng.
+    """
+    seqs = iter(SeedSequence(seed).spawn(3 * 2 * n_active))
+    return tuple(tuple(tuple(BufferedGenerator(next(seqs), block) for _ in range(n_active)) for _ in range(2))
+                 for _ in range(3))
+
+
 # Generator that always returns 0
 ZERO_RNG = DeterministicGenerator(config_value=0)
 # Generator that always returns 0.99999...